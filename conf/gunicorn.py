@@ -1,7 +1,13 @@
 from hub2labhook.config import logfile_path
+from hub2labhook import transport
 
 logconfig = logfile_path(debug=False)
 bind = 'unix:/tmp/gunicorn_registry.sock'
 workers = 2
 worker_class = 'gthread'
 preload_app = True
+
+
+def post_fork(server, worker):
+    # preload_app: drop the HTTP connections inherited from the master
+    transport.reset_sessions()
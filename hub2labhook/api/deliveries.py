@@ -0,0 +1,67 @@
+"""
+De-duplication of the webhook deliveries.
+
+GitHub redelivers a hook when we answer late, and hooks are replayed by
+hand: each duplicate would enqueue the same build again. Every delivery is
+claimed in Redis (SET NX with a TTL) before its tasks are enqueued, so a
+duplicate is acknowledged without reaching the broker.
+
+GitHub deliveries are identified by X-GitHub-Delivery, GitLab hooks have no
+delivery id and are identified by a digest of their body. Without Redis the
+claims are kept in-process only.
+"""
+
+import hashlib
+import logging
+
+import redis
+
+from hub2labhook import metrics
+from hub2labhook.cache import LRUCache, redis_client, redis_failed
+from hub2labhook.config import FFCONFIG
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_KEY = "ffci:delivery:%s"
+
+_local_deliveries = LRUCache(maxsize=4096, ttl=FFCONFIG.failfast["delivery_ttl"])
+
+
+def delivery_key(headers, body: bytes) -> str:
+    delivery = headers.get("X-GitHub-Delivery", None)
+    if delivery:
+        return "github:%s" % delivery
+    return "body:%s" % hashlib.sha256(body).hexdigest()
+
+
+def claim(key: str) -> bool:
+    """Returns False if the delivery was already claimed"""
+    ttl = FFCONFIG.failfast["delivery_ttl"]
+    client = redis_client()
+    if client is not None:
+        try:
+            claimed = client.set(DELIVERY_KEY % key, 1, nx=True, ex=ttl) is not None
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+        else:
+            if not claimed:
+                logger.info("Duplicate delivery %s", key)
+                metrics.incr("webhook_duplicates")
+            return claimed
+    if _local_deliveries.get(key) is not None:
+        metrics.incr("webhook_duplicates")
+        return False
+    _local_deliveries.set(key, True)
+    return True
+
+
+def release(key: str) -> None:
+    """Forgets a delivery that couldn't be processed, a redelivery is accepted"""
+    _local_deliveries.delete(key)
+    client = redis_client()
+    if client is None:
+        return
+    try:
+        client.delete(DELIVERY_KEY % key)
+    except redis.exceptions.RedisError as exc:
+        redis_failed(exc)
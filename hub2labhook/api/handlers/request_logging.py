@@ -37,11 +37,9 @@ def filter_logs(values, filtered_fields):
 
 
 def after_request_log(resp):
-    jsonbody = request.get_json(force=True, silent=True)
-    values = request.values.to_dict()
-
-    if jsonbody and not isinstance(jsonbody, dict):
-        jsonbody = {"_parsererror": jsonbody}
+    # The body isn't parsed again (nor logged): webhook payloads are large
+    # and handled by the workers
+    values = request.args.to_dict()
 
     if isinstance(values, dict):
         filter_logs(values, FILTERED_VALUES)
@@ -55,7 +53,8 @@ def after_request_log(resp):
         "path": request.path,
         "parameters": values,
         "response_time": request.request_time(),
-        "json_body": jsonbody,
+        "content_length": request.content_length,
+        "status_code": resp.status_code,
         "version": "%s/%s" % (hub2labhook.__version__, hub2labhook.__gitsha__),
     }
     if request.user_agent is not None:
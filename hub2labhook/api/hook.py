@@ -1,13 +1,15 @@
 import hmac
-import re
 import hashlib
 from flask import jsonify, request, Blueprint
+from hub2labhook.api import deliveries
 from hub2labhook.api.app import getvalues
 from hub2labhook.exception import InvalidUsage, Forbidden, Unsupported
 import hub2labhook.jobs.tasks as tasks
-from hub2labhook.github.models.event import GithubEvent
 from hub2labhook.config import FFCONFIG
 
+# Headers of a GitHub delivery passed to the tasks
+ROUTING_HEADERS = ("X-GitHub-Event", "X-GitHub-Delivery")
+
 ffapi_app = Blueprint(
     "ffapi",
     __name__,
@@ -38,56 +40,37 @@ def verify_signature(payload_body, signature):
     return True
 
 
+def deduplicated(handler):
+    """Runs handler() unless the delivery was already received. A delivery
+    that fails to be processed is released, GitHub can redeliver it"""
+    key = deliveries.delivery_key(
+        request.headers, request.query_string + b"?" + request.get_data()
+    )
+    if not deliveries.claim(key):
+        return jsonify({"duplicate": True})
+    try:
+        return handler()
+    except Exception:
+        deliveries.release(key)
+        raise
+
+
 @ffapi_app.route("/api/v1/github_event", methods=["POST"], strict_slashes=False)
 def github_event():
-    params = getvalues()
     hook_signature = request.headers.get("X-Hub-Signature", None)
 
     if hook_signature:
         verify_signature(request.data, hook_signature)
 
-    headers = dict(request.headers)
-    gevent = GithubEvent(params, headers)
-    job = None
-    if gevent.event_type == "check_run" and gevent.action == "rerequested":
-        job = tasks.retry_build.delay(gevent.external_id, gevent.head_sha)
-    elif gevent.event_type == "check_run" and gevent.action == "requested_action":
-        job = tasks.request_action(
-            gevent.event["requested_action"]["identifier"], params
-        )
-        if job is not None:
-            job = job.delay()
-    elif gevent.event_type == "check_suite" and gevent.action == "rerequested":
-        headers["X-GITHUB-EVENT"] = "pull_request"
-        headers["X-GITHUB-PREV-EVENT"] = "check_suite"
-        params["prev_action"] = params["action"]
-        params["action"] = "synchronize"
-        job = tasks.prep_retry_check_suite.s(params) | tasks.pipeline.s(headers)
-        job = job.delay()
-    elif (
-        gevent.event_type == "issue_comment"
-        and gevent.action == "created"
-        and "pull_request" in gevent.event["issue"]
-    ):
-        comment = gevent.event["comment"]["body"]
-        if re.search("^.*\\/retest-failed( .*|$)", comment) is not None:
-            pull_url = gevent.event["issue"]["pull_request"]["url"]
-            job = tasks.prep_retry_failed.s(params, pull_url)
-        elif re.search("^.*\\/retest( .*|$)", comment) is not None:
-            headers["X-GITHUB-EVENT"] = "pull_request"
-            headers["X-GITHUB-PREV-EVENT"] = "check_suite"
-            params["prev_action"] = params["action"]
-            params["action"] = "synchronize"
-            job = tasks.prep_retry_comment.s(params) | tasks.pipeline.s(headers)
-        if job is not None:
-            job = job.delay()
-    elif gevent.event_type in ["push", "pull_request"]:
-        job = tasks.start_pipeline(params, headers)
-        if job is not None:
-            job = job.delay()
-    if job is None:
-        return jsonify({"ignored": True, "event": params, "headers": headers})
-    return jsonify({"job_id": job.id, "params": params})
+    return deduplicated(_github_event)
+
+
+def _github_event():
+    # Only the routing headers are forwarded, the payload isn't parsed here:
+    # route_event decides what to do with it
+    headers = {k: request.headers[k] for k in ROUTING_HEADERS if k in request.headers}
+    job = tasks.route_event.delay(request.get_data(as_text=True), headers)
+    return jsonify({"job_id": job.id}), 202
 
 
 @ffapi_app.route("/api/v1/gitlab_event", methods=["POST", "GET"], strict_slashes=False)
@@ -95,13 +78,15 @@ def gitlab_event():
     params = getvalues()
     headers = dict(request.headers)
     event = headers.get("X-Gitlab-Event", None)
-    if event == "Pipeline Hook":
-        task = tasks.update_github_check
-    elif event == "Job Hook":
-        task = tasks.update_github_check
-    else:
+    if event not in ["Pipeline Hook", "Job Hook"]:
         return jsonify({"ignored": True, "event": event, "headers": headers})
-    job = task.delay(params)
+    return deduplicated(lambda: _gitlab_event(params))
+
+
+def _gitlab_event(params):
+    job = tasks.coalesce_gitlab_event(params)
+    if job is None:
+        return jsonify({"coalesced": True})
     return jsonify({"job_id": job.id, "params": params})
 
 
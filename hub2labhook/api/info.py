@@ -3,6 +3,7 @@ import logging
 
 from flask import jsonify, Blueprint, current_app, url_for
 from hub2labhook.exception import Forbidden
+from hub2labhook import metrics
 import hub2labhook
 
 info_app = Blueprint(
@@ -34,6 +35,11 @@ def version():
     return jsonify({"hub2lab-api": hub2labhook.__version__})
 
 
+@info_app.route("/stats")
+def stats():
+    return jsonify(metrics.snapshot())
+
+
 @info_app.route("/routes")
 def routes():
     import urllib
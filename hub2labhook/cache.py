@@ -0,0 +1,160 @@
+"""
+Caches shared by the API and the workers.
+
+`LRUCache` is a thread-safe, bounded, in-process cache with per-entry expiry.
+`SharedCache` puts a `LRUCache` in front of Redis so values are shared between
+worker processes. Redis errors are logged and treated as cache misses: a
+broken cache must never break a build.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from hub2labhook.config import FFCONFIG
+
+logger = logging.getLogger(__name__)
+
+# After a Redis error, shared caches fall back to in-process only for that long
+REDIS_RETRY_DELAY = 30
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    def __init__(self, maxsize: int = 1024, ttl: float = None) -> None:
+        """
+        Args:
+          maxsize (:obj:`int`) number of entries kept, least recently used are evicted first
+          ttl (:obj:`float`) default lifetime of an entry in seconds, `None` never expires
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = None
+        if ttl is not None:
+            expires_at = time.time() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_redis = {"client": None, "url": None, "down_until": 0.0}
+_redis_lock = threading.Lock()
+
+
+def redis_client():
+    """Returns the shared Redis client, or `None` if Redis is disabled or recently failed"""
+    url = FFCONFIG.failfast.get("redis_url", None)
+    if not url or _redis["down_until"] > time.time():
+        return None
+    with _redis_lock:
+        if _redis["client"] is None or _redis["url"] != url:
+            _redis["client"] = redis.Redis.from_url(
+                url, socket_timeout=2, socket_connect_timeout=2
+            )
+            _redis["url"] = url
+        return _redis["client"]
+
+
+def redis_failed(exc: Exception) -> None:
+    """Disables the Redis layer of the shared caches for `REDIS_RETRY_DELAY` seconds"""
+    logger.warning(
+        "Redis unavailable, using in-process caches for %ss: %s", REDIS_RETRY_DELAY, exc
+    )
+    _redis["down_until"] = time.time() + REDIS_RETRY_DELAY
+
+
+class SharedCache(object):
+    def __init__(self, namespace: str, ttl: float, maxsize: int = 1024) -> None:
+        """A `LRUCache` backed by Redis, values must be JSON serializable
+
+        Args:
+          namespace (:obj:`str`) prefix of the Redis keys
+          ttl (:obj:`float`) default lifetime of an entry in seconds
+          maxsize (:obj:`int`) number of entries kept in-process
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def _key(self, key) -> str:
+        return "%s:%s" % (self.namespace, key)
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        client = redis_client()
+        if client is None:
+            return default
+        try:
+            raw, pttl = client.pipeline().get(self._key(key)).pttl(self._key(key)).execute()
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+            return default
+        if raw is None:
+            return default
+        value = json.loads(raw)
+        # Never keep a value in-process longer than Redis would
+        ttl = self.ttl
+        if pttl is not None and pttl > 0:
+            ttl = min(ttl, pttl / 1000.0)
+        self.local.set(key, value, ttl=ttl)
+        return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        self.local.set(key, value, ttl=ttl)
+        client = redis_client()
+        if client is None:
+            return
+        try:
+            client.set(self._key(key), json.dumps(value), px=max(int(ttl * 1000), 1))
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+
+    def delete(self, key) -> None:
+        self.local.delete(key)
+        client = redis_client()
+        if client is None:
+            return
+        try:
+            client.delete(self._key(key))
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
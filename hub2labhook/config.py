@@ -3,6 +3,7 @@ Acquire runtime configuration from environment variables (etc).
 """
 
 import os
+import tempfile
 import yaml
 
 
@@ -53,6 +54,14 @@ def envbool(value: str):
 
 
 GITLAB_TIMEOUT = 30
+# Seconds a resolved GitLab project (id, urls) is reused by a worker
+GITLAB_PROJECT_CACHE_TTL = getenv("GITLAB_PROJECT_CACHE_TTL", default=3600, convert=int)
+# Seconds a CI lint verdict is reused for the same CI file content
+GITLAB_LINT_CACHE_TTL = getenv("GITLAB_LINT_CACHE_TTL", default=86400, convert=int)
+GITHUB_TIMEOUT = getenv("GITHUB_TIMEOUT", default=30, convert=int)
+
+# Keep-alive connections kept per API host and per process
+FAILFASTCI_HTTP_POOL_SIZE = getenv("FAILFASTCI_HTTP_POOL_SIZE", default=10, convert=int)
 
 APP_ENVIRON = getenv("APP_ENV", "development")
 
@@ -97,6 +106,49 @@ FAILFASTCI_API = getenv("FAILFAST_CI_API", "https://jobs.failfast-ci.com")
 FAILFASTCI_ENABLE_LINTER = getenv(
     "FAILFASTCI_ENABLE_LINTER", default=True, convert=envbool
 )
+# Redis used for the caches shared between the API and the workers.
+# Defaults to the celery broker, set to 'none' to keep caches in-process only
+FAILFASTCI_REDIS_URL = getenv(
+    "FAILFASTCI_REDIS_URL", getenv("CELERY_BROKER", "redis://")
+)
+if FAILFASTCI_REDIS_URL.lower() in ("none", ""):
+    FAILFASTCI_REDIS_URL = None
+# Seconds the hooks of a GitLab job/pipeline are held so that only its latest
+# state is forwarded to GitHub, 0 disables it
+FAILFASTCI_COALESCE_WINDOW = getenv(
+    "FAILFASTCI_COALESCE_WINDOW", default=2.0, convert=float
+)
+# Directory of the bare mirrors the repositories are cloned from, unset disables the cache
+FAILFASTCI_GIT_CACHE_DIR = getenv("FAILFASTCI_GIT_CACHE_DIR", None)
+# Disk budget (bytes) of the mirrors, least recently used are evicted above it
+FAILFASTCI_GIT_CACHE_BUDGET = getenv(
+    "FAILFASTCI_GIT_CACHE_BUDGET", default=20 * 1024**3, convert=int
+)
+# Build directories: removed after each build, least recently used evicted above the quota (bytes)
+FAILFASTCI_WORKSPACE_DIR = getenv(
+    "FAILFASTCI_WORKSPACE_DIR",
+    os.path.join(tempfile.gettempdir(), "failfast-ci-workspaces"),
+)
+FAILFASTCI_WORKSPACE_QUOTA = getenv(
+    "FAILFASTCI_WORKSPACE_QUOTA", default=10 * 1024**3, convert=int
+)
+# How repositories are cloned: full, shallow (--depth) or partial (--filter=blob:none)
+FAILFASTCI_CLONE_STRATEGY = getenv("FAILFASTCI_CLONE_STRATEGY", "full")
+FAILFASTCI_CLONE_DEPTH = getenv("FAILFASTCI_CLONE_DEPTH", default=50, convert=int)
+FAILFASTCI_CLONE_SKIP_LFS = getenv(
+    "FAILFASTCI_CLONE_SKIP_LFS", default=False, convert=envbool
+)
+# Seconds a webhook delivery is remembered to drop its duplicates
+FAILFASTCI_DELIVERY_TTL = getenv("FAILFASTCI_DELIVERY_TTL", default=86400, convert=int)
+# Minimum seconds between two progress updates of the sync check-run
+FAILFASTCI_PROGRESS_INTERVAL = getenv(
+    "FAILFASTCI_PROGRESS_INTERVAL", default=5.0, convert=float
+)
+# .failfast-ci.jsonnet evaluation limits: seconds, number of imported files
+FAILFASTCI_JSONNET_TIMEOUT = getenv("FAILFASTCI_JSONNET_TIMEOUT", default=30, convert=int)
+FAILFASTCI_JSONNET_MAX_IMPORTS = getenv(
+    "FAILFASTCI_JSONNET_MAX_IMPORTS", default=100, convert=int
+)
 # The GitLab runner tag to require on CI jobs introduced by failfast
 FAILFASTCI_REQUIRE_RUNNER_TAG = getenv("FAILFASTCI_RUNNER_TAG", "failfast-ci")
 
@@ -130,6 +182,26 @@ class FailFastConfig(object):
                 "env": APP_ENVIRON,
                 "enable_linter": FAILFASTCI_ENABLE_LINTER,
                 "failfast_url": FAILFASTCI_API,
+                "redis_url": FAILFASTCI_REDIS_URL,
+                "http_pool_size": FAILFASTCI_HTTP_POOL_SIZE,
+                "coalesce_window": FAILFASTCI_COALESCE_WINDOW,
+                "git_cache_dir": FAILFASTCI_GIT_CACHE_DIR,
+                "git_cache_budget": FAILFASTCI_GIT_CACHE_BUDGET,
+                "workspace_dir": FAILFASTCI_WORKSPACE_DIR,
+                "workspace_quota": FAILFASTCI_WORKSPACE_QUOTA,
+                "clone": {
+                    "strategy": FAILFASTCI_CLONE_STRATEGY,
+                    "depth": FAILFASTCI_CLONE_DEPTH,
+                    "skip_lfs": FAILFASTCI_CLONE_SKIP_LFS,
+                    # per repository overrides, e.g. {"org/repo": {"strategy": "partial"}}
+                    "repos": {},
+                },
+                "progress_interval": FAILFASTCI_PROGRESS_INTERVAL,
+                "delivery_ttl": FAILFASTCI_DELIVERY_TTL,
+                "jsonnet": {
+                    "timeout": FAILFASTCI_JSONNET_TIMEOUT,
+                    "max_imports": FAILFASTCI_JSONNET_MAX_IMPORTS,
+                },
                 "build": {
                     "required-labels": [
                         ["ok-to-test", "lgtm", "approved"],
@@ -156,10 +228,13 @@ class FailFastConfig(object):
                 "context-status": GITHUB_CONTEXT,
                 "secret_token": GITHUB_SECRET_TOKEN,
                 "integration_id": GITHUB_INTEGRATION_ID,
+                "timeout": GITHUB_TIMEOUT,
             },
             "gitlab": {
                 "repo": GITLAB_REPO,
                 "timeout": GITLAB_TIMEOUT,
+                "project_cache_ttl": GITLAB_PROJECT_CACHE_TTL,
+                "lint_cache_ttl": GITLAB_LINT_CACHE_TTL,
                 "secret_token": GITLAB_SECRET_TOKEN,
                 "gitlab_url": GITLAB_API,
                 "privacy": GITLAB_REPO_PRIVACY,
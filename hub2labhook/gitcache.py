@@ -0,0 +1,163 @@
+"""
+On-disk cache of bare mirrors of the GitHub repositories.
+
+Builds clone from a local mirror, kept up to date with incremental fetches,
+instead of cloning the whole repository from GitHub. A local clone hardlinks
+the objects of the mirror when both are on the same filesystem (it copies them
+otherwise), so the build checkout doesn't depend on the mirror afterwards and
+mirrors can be evicted at any time they are not locked.
+
+The size of each mirror is measured after its fetch and stored next to it,
+so the eviction doesn't scan every mirror on every clone.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import shutil
+import time
+
+from git import Repo
+
+from hub2labhook import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MirrorCache(object):
+    def __init__(self, root: str, budget: int) -> None:
+        """
+        Args:
+          root (:obj:`str`) directory of the mirrors
+          budget (:obj:`int`) disk usage in bytes above which the least recently
+                              used mirrors are evicted
+        """
+        self.root = root
+        self.budget = budget
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, repo: str) -> str:
+        return os.path.join(self.root, "%s.git" % repo.replace("/", "__"))
+
+    @contextlib.contextmanager
+    def lock(self, repo: str, blocking: bool = True):
+        """Exclusive flock of a mirror, held to fetch, clone from or evict it"""
+        mode = fcntl.LOCK_EX
+        if not blocking:
+            mode |= fcntl.LOCK_NB
+        lockpath = self.path(repo) + ".lock"
+        while True:
+            lockfile = open(lockpath, "a")
+            try:
+                fcntl.flock(lockfile, mode)
+                # evict() removes the lock file of the mirrors, retry if this
+                # one was removed while waiting for it
+                try:
+                    current = os.stat(lockpath)
+                except FileNotFoundError:
+                    continue
+                if os.path.samestat(current, os.fstat(lockfile.fileno())):
+                    break
+            except BaseException:
+                lockfile.close()
+                raise
+            lockfile.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+
+    @staticmethod
+    def disk_usage(path: str) -> int:
+        """Size in bytes of the objects of a repository"""
+        stats = {}
+        for line in Repo(path).git.count_objects("-v").splitlines():
+            key, value = line.split(":", 1)
+            stats[key] = value.strip()
+        kib = sum(int(stats.get(k, 0)) for k in ("size", "size-pack", "size-garbage"))
+        return kib * 1024
+
+    def usage(self, path: str) -> int:
+        """Size of a mirror measured after its last fetch"""
+        try:
+            with open(path + ".size") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return self._measure(path)
+
+    def _measure(self, path: str) -> int:
+        size = self.disk_usage(path)
+        with open(path + ".size", "w") as f:
+            f.write(str(size))
+        return size
+
+    def update(self, repo: str, url: str, refspecs: list) -> str:
+        """Fetches `refspecs` from `url` in the mirror of `repo`, creating it if needed.
+        The url (and its credentials) isn't stored in the mirror"""
+        with self.lock(repo):
+            return self._update(repo, url, refspecs)
+
+    def _update(self, repo: str, url: str, refspecs: list) -> str:
+        path = self.path(repo)
+        if os.path.exists(path):
+            metrics.incr("git_mirror_hits")
+            mirror = Repo(path)
+            size = self.usage(path)
+        else:
+            metrics.incr("git_mirror_misses")
+            mirror = Repo.init(path, bare=True)
+            size = 0
+        start = time.time()
+        mirror.git.fetch(url, "--prune", "--tags", "--force", *refspecs)
+        fetched = max(self._measure(path) - size, 0)
+        metrics.incr("git_mirror_fetched_bytes", fetched)
+        logger.info(
+            "Updated mirror %s: %s bytes in %.1fs", repo, fetched, time.time() - start
+        )
+        os.utime(path)
+        return path
+
+    def clone(self, repo: str, url: str, dest: str, refspecs: list, env=None) -> Repo:
+        """Updates the mirror of `repo` then clones it to `dest`. The lock is
+        held until cloned, so the mirror isn't evicted in between"""
+        with self.lock(repo):
+            path = self._update(repo, url, refspecs)
+            clone = Repo.clone_from(path, dest, env=env)
+        self.evict()
+        return clone
+
+    def evict(self) -> None:
+        """Removes the least recently used mirrors until the cache fits its budget"""
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                mirrors.append((os.path.getmtime(path), name[: -len(".git")], path))
+        usage = {path: self.usage(path) for _, _, path in mirrors}
+        total = sum(usage.values())
+        for _, name, path in sorted(mirrors):
+            if total <= self.budget:
+                break
+            repo = name.replace("__", "/")
+            try:
+                with self.lock(repo, blocking=False):
+                    shutil.rmtree(path)
+                    for extra in (".size", ".lock"):
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(path + extra)
+            except BlockingIOError:
+                # in use, try the next one
+                continue
+            total -= usage[path]
+            metrics.incr("git_mirror_evictions")
+            logger.info("Evicted mirror %s", repo)
+
+
+def mirror_cache(config):
+    """Returns the MirrorCache configured in `failfast.git_cache_dir`, None if disabled"""
+    root = config.failfast.get("git_cache_dir", None)
+    if not root:
+        return None
+    return MirrorCache(root, config.failfast["git_cache_budget"])
@@ -0,0 +1,193 @@
+"""
+Bookkeeping of the check-runs created on GitHub for GitLab jobs and pipelines.
+
+Each GitLab object (project, object_kind, object_id) maps to a single
+check-run: the first event creates it, the following ones update it.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+
+import redis
+import requests
+
+from hub2labhook.cache import LRUCache, SharedCache, redis_client, redis_failed
+from hub2labhook import metrics
+
+logger = logging.getLogger(__name__)
+
+# Check-runs are only updated while the GitLab job/pipeline runs or is retried
+CHECK_RUN_TTL = 7 * 86400
+
+# "project_id:object_kind:object_id" -> check-run id
+CHECK_RUN_IDS = SharedCache("ffci:github:check-run", ttl=CHECK_RUN_TTL, maxsize=4096)
+
+# "project_id:object_kind:object_id" -> CheckStatus.state_order of the last event sent
+CHECK_RUN_STATES_KEY = "ffci:github:check-state:%s"
+_local_states = LRUCache(maxsize=4096, ttl=CHECK_RUN_TTL)
+_local_states_lock = threading.Lock()
+
+# KEYS: state key, ARGV: state order, expiration (ms)
+ADVANCE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and ARGV[1] < current then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# GitLab sha -> GitHub sha, when the sync pushed a generated commit on top of it
+CI_SHAS = SharedCache("ffci:github:ci-sha", ttl=CHECK_RUN_TTL, maxsize=1024)
+
+# "check:<check_key>", "check-run:<id>" or "status:<repo>:<sha>:<context>"
+#  -> digest of the last payload sent
+PAYLOAD_DIGESTS = SharedCache("ffci:github:payload", ttl=CHECK_RUN_TTL, maxsize=8192)
+
+
+def payload_digest(body, ignore=()):
+    content = {k: v for k, v in body.items() if k not in ignore}
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def is_unchanged(key, body, ignore=()):
+    """True if the same payload was the last one sent for `key`"""
+    if PAYLOAD_DIGESTS.get(key) != payload_digest(body, ignore):
+        return False
+    logger.info("Payload unchanged, skip GitHub update: %s", key)
+    metrics.incr("github_unchanged_updates_skipped")
+    return True
+
+
+def remember_payload(key, body, ignore=()):
+    PAYLOAD_DIGESTS.set(key, payload_digest(body, ignore))
+
+
+# The generated commits carry the GitHub sha, so it's known without CI_SHAS
+GENERATED_COMMIT = "[failfast-ci] .gitlab-ci.yml generated from %s\n\nGithub-Sha: %s\n"
+GENERATED_COMMIT_RE = re.compile(
+    r"^\[failfast-ci\] \.gitlab-ci\.yml generated(?:.*^Github-Sha: ([0-9a-f]{40})$)?",
+    re.DOTALL | re.MULTILINE,
+)
+
+# GitLab shas not found in CI_SHAS: commits pushed as is
+_unmapped_shas = LRUCache(maxsize=4096, ttl=3600)
+
+
+def generated_commit_message(source, sha):
+    return GENERATED_COMMIT % (source, sha)
+
+
+def map_ci_sha(ci_sha, sha):
+    """Records that the GitLab commit `ci_sha` builds the GitHub commit `sha`"""
+    _unmapped_shas.delete(ci_sha)
+    CI_SHAS.set(ci_sha, sha)
+
+
+def github_sha(ci_sha, message=None):
+    """
+    The GitHub commit built by a GitLab commit
+
+    Args:
+      ci_sha (:obj:`str`) sha of the GitLab commit
+      message (:obj:`str`) its message when known: the GitHub sha is read from
+                           a generated commit, other commits are GitHub's
+    """
+    if message is not None:
+        match = GENERATED_COMMIT_RE.match(message)
+        if match is None:
+            return ci_sha
+        if match.group(1):
+            return match.group(1)
+    if _unmapped_shas.get(ci_sha) is not None:
+        return ci_sha
+    sha = CI_SHAS.get(ci_sha)
+    if sha is None:
+        _unmapped_shas.set(ci_sha, True)
+        return ci_sha
+    return sha
+
+
+def advance_state(checkstatus):
+    """
+    Records the state of a job/pipeline about to be sent to GitHub.
+    Returns False if a more advanced state was already sent: celery doesn't
+    preserve ordering and an old 'running' event must not overwrite 'success'.
+    The same state is accepted again, a retried update isn't dropped.
+    """
+    key, order = checkstatus.check_key, checkstatus.state_order
+    client = redis_client()
+    if client is not None:
+        try:
+            return (
+                client.eval(
+                    ADVANCE_SCRIPT,
+                    1,
+                    CHECK_RUN_STATES_KEY % key,
+                    order,
+                    CHECK_RUN_TTL * 1000,
+                )
+                == 1
+            )
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+    with _local_states_lock:
+        current = _local_states.get(key)
+        if current is not None and order < current:
+            return False
+        _local_states.set(key, order)
+        return True
+
+
+def check_run_body(check):
+    """The body of a check-run update, GitHub doesn't accept a head_sha on PATCH"""
+    return {k: v for k, v in check.items() if k != "head_sha"}
+
+
+def publish_check(githubclient, github_repo, checkstatus, check):
+    """Updates the check-run of a GitLab object, creates it if there is none yet"""
+    digest_key = "check:%s" % checkstatus.check_key
+    check_id = CHECK_RUN_IDS.get(checkstatus.check_key)
+    if check_id is not None:
+        if is_unchanged(digest_key, check):
+            return {"id": check_id}
+        try:
+            resp = githubclient.update_check_run(
+                github_repo, check_run_body(check), check_id
+            )
+            remember_payload(digest_key, check)
+            return resp
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code not in (404, 422):
+                raise
+            logger.info("Check-run %s is gone, creating a new one: %s", check_id, e)
+    resp = githubclient.create_check(github_repo, check)
+    CHECK_RUN_IDS.set(checkstatus.check_key, resp["id"])
+    remember_payload(digest_key, check)
+    return resp
+
+
+def post_status(githubclient, body, github_repo, sha):
+    """Posts a commit status, unless the same one was already posted"""
+    key = "status:%s:%s:%s" % (github_repo, sha, body["context"])
+    if is_unchanged(key, body):
+        return None
+    resp = githubclient.post_status(body, github_repo, sha)
+    remember_payload(key, body)
+    return resp
+
+
+def update_check_run(githubclient, github_repo, check, check_id, ignore=()):
+    """Updates a check-run, unless the same update was already sent.
+    `ignore` lists the fields left out of the comparison, e.g. timestamps"""
+    key = "check-run:%s" % check_id
+    if is_unchanged(key, check, ignore):
+        return None
+    resp = githubclient.update_check_run(github_repo, check, check_id)
+    remember_payload(key, check, ignore)
+    return resp
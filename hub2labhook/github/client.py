@@ -1,17 +1,35 @@
 import json
 import os
+import calendar
 import datetime
+import functools
 import random
 import base64
+import threading
+import time
+import zlib
 import jwt
 import requests
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 import hub2labhook
+from hub2labhook.cache import SharedCache
+from hub2labhook import transport
 from hub2labhook.exception import ResourceNotFound
 
 from hub2labhook.config import FFCONFIG
 
 INTEGRATION_ID = int(FFCONFIG.github["integration_id"])
 
+# Installation tokens are valid 1 hour, they are refreshed that many seconds
+# before GitHub expires them so a token never expires in the middle of a task
+TOKEN_REFRESH_MARGIN = 300
+# App JWTs are valid up to 10 minutes
+JWT_LIFETIME = 540
+JWT_REFRESH_MARGIN = 60
+
+# installation_id -> {"token": str, "expires_at": epoch}
+INSTALLATION_TOKENS = SharedCache("ffci:github:token", ttl=3600, maxsize=512)
+
 GITHUB_STATUS_MAP = {
     "failed": "failure",
     "success": "success",
@@ -44,8 +62,11 @@ def icon_url(icon):
     return f"https://ffci-pub.s3.eu-central-1.amazonaws.com/icons/{icon}.png"
 
 
-def random_icon(name, max):
-    return f"{name}{random.randint(1, max)}"
+def random_icon(name, max, seed=None):
+    """Picks one of the `max` variants of an icon, always the same one for a given seed"""
+    if seed is None:
+        return f"{name}{random.randint(1, max)}"
+    return f"{name}{zlib.crc32(str(seed).encode()) % max + 1}"
 
 
 class Icons(dict):
@@ -53,17 +74,23 @@ class Icons(dict):
         return icon_url("unknown")
 
     def __getitem__(self, key):
+        return self.icon(key)
+
+    def icon(self, key, seed=None):
+        """Returns the icon url of a status, `seed` selects the variant of random icons"""
+        if key not in self:
+            return self.__missing__(key)
         item = dict.__getitem__(self, key)
         if isinstance(item, str):
             return item
-        return item()
+        return item(seed)
 
 
 GITHUB_CHECK_ICONS = Icons(
     {
         "allow_failure": icon_url("warning"),
         "failed": icon_url("siren"),
-        "success": lambda: icon_url(random_icon("happy", 11)),
+        "success": lambda seed=None: icon_url(random_icon("happy", 11, seed)),
         "success_check": icon_url("check"),
         "skipped": icon_url("portal"),
         "unknown": icon_url("siren"),
@@ -77,30 +104,55 @@ GITHUB_CHECK_ICONS = Icons(
 )
 
 
-def jwt_token(integration_id, integration_pem):
+def jwt_token(integration_id, integration_pem, lifetime=60):
     payload = {
-        "iat": datetime.datetime.utcnow(),
-        "exp": (datetime.datetime.utcnow() + datetime.timedelta(seconds=60)),
+        # backdated to allow for clock drift with GitHub
+        "iat": datetime.datetime.utcnow() - datetime.timedelta(seconds=30),
+        "exp": (datetime.datetime.utcnow() + datetime.timedelta(seconds=lifetime)),
         "iss": integration_id,
     }
 
     return jwt.encode(payload, integration_pem, algorithm="RS256")
 
 
+@functools.lru_cache(maxsize=4)
+def load_integration_key(integration_pem):
+    """Parses the App private key once per process"""
+    return load_pem_private_key(integration_pem, password=None)
+
+
+_app_jwt = {"token": None, "expires_at": 0.0}
+_app_jwt_lock = threading.Lock()
+
+
+def app_jwt(integration_id, integration_pem):
+    """Returns the App JWT, signed again only when close to its expiration"""
+    with _app_jwt_lock:
+        if _app_jwt["expires_at"] - JWT_REFRESH_MARGIN <= time.time():
+            _app_jwt["token"] = jwt_token(
+                integration_id, load_integration_key(integration_pem), JWT_LIFETIME
+            )
+            _app_jwt["expires_at"] = time.time() + JWT_LIFETIME
+        return _app_jwt["token"]
+
+
+def parse_expires_at(expires_at):
+    """Converts GitHub '2016-07-11T22:14:10Z' timestamps to epoch"""
+    return calendar.timegm(time.strptime(expires_at, "%Y-%m-%dT%H:%M:%SZ"))
+
+
 class GithubClient(object):
     def __init__(self, installation_id):
         self.installation_id = installation_id
-        self._token = None
         self.endpoint = "https://api.github.com"
-        self._integration_pem = None
+
+    @property
+    def session(self):
+        return transport.session(self.endpoint, timeout=FFCONFIG.github["timeout"])
 
     @property
     def integration_pem(self):
-        if self._integration_pem is None:
-            self._integration_pem = base64.b64decode(
-                os.environ["GITHUB_INTEGRATION_PEM"]
-            )
-        return self._integration_pem
+        return base64.b64decode(os.environ["GITHUB_INTEGRATION_PEM"])
 
     def headers(self, extra=None):
         headers = {
@@ -126,26 +178,35 @@ class GithubClient(object):
 
     @property
     def token(self):
-        if not self._token:
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/vnd.github.machine-man-preview+json",
-                "User-Agent": "hub2lab: %s" % hub2labhook.__version__,
-                "Authorization": "Bearer %s"
-                % jwt_token(INTEGRATION_ID, self.integration_pem),
-            }
-            path = self._url(
-                "/app/installations/%s/access_tokens" % self.installation_id
+        """The installation token, shared by all clients of the same installation"""
+        cached = INSTALLATION_TOKENS.get(str(self.installation_id))
+        if cached is None or cached["expires_at"] - TOKEN_REFRESH_MARGIN <= time.time():
+            cached = self._create_token()
+            INSTALLATION_TOKENS.set(
+                str(self.installation_id),
+                cached,
+                ttl=max(cached["expires_at"] - TOKEN_REFRESH_MARGIN - time.time(), 1),
             )
+        return cached["token"]
 
-            resp = requests.post(path, headers=headers)
-            resp.raise_for_status()
-            self._token = resp.json()["token"]
-        return self._token
+    def _create_token(self):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.github.machine-man-preview+json",
+            "User-Agent": "hub2lab: %s" % hub2labhook.__version__,
+            "Authorization": "Bearer %s"
+            % app_jwt(INTEGRATION_ID, self.integration_pem),
+        }
+        path = self._url("/app/installations/%s/access_tokens" % self.installation_id)
+
+        resp = self.session.post(path, headers=headers)
+        resp.raise_for_status()
+        body = resp.json()
+        return {"token": body["token"], "expires_at": parse_expires_at(body["expires_at"])}
 
     def post_status(self, body, github_repo, sha):
         path = self._url("/repos/%s/commits/%s/statuses" % (github_repo, sha))
-        resp = requests.post(
+        resp = self.session.post(
             path, data=json.dumps(body), headers=self.headers(), timeout=5
         )
         resp.raise_for_status()
@@ -153,7 +214,7 @@ class GithubClient(object):
 
     def fetch_file(self, repo, file_path, ref="master"):
         path = self._url("/repos/%s/contents/%s" % (repo, file_path))
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers(), params={"ref": ref}, timeout=30
         )
         resp.raise_for_status()
@@ -164,7 +225,7 @@ class GithubClient(object):
         return filecontent
 
     def get_json(self, path, params={}):
-        resp = requests.get(path, headers=self.headers(), params=params)
+        resp = self.session.get(path, headers=self.headers(), params=params)
         resp.raise_for_status()
         return resp.json()
 
@@ -182,7 +243,7 @@ class GithubClient(object):
 
     def get_checks(self, github_repo, sha):
         path = self._url("/repos/%s/commits/%s/check-runs" % (github_repo, sha))
-        resp = requests.get(
+        resp = self.session.get(
             path,
             headers=self.headers(
                 {"Accept": "application/vnd.github.antiope-preview+json"}
@@ -194,7 +255,7 @@ class GithubClient(object):
 
     def create_check(self, github_repo, check_body):
         path = self._url("/repos/%s/check-runs" % github_repo)
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(check_body),
             headers=self.headers(
@@ -207,7 +268,7 @@ class GithubClient(object):
 
     def update_check_run(self, github_repo, check_body, check_id):
         path = self._url("/repos/%s/check-runs/%s" % (github_repo, check_id))
-        resp = requests.patch(
+        resp = self.session.patch(
             path,
             data=json.dumps(check_body),
             headers=self.headers(
@@ -221,7 +282,7 @@ class GithubClient(object):
         path = self._url(
             "/repos/%s/check-runs/%s/rerequest" % (github_repo, check_run_id)
         )
-        resp = requests.post(
+        resp = self.session.post(
             path,
             headers=self.headers(
                 {"Accept": "application/vnd.github.antiope-preview+json"}
@@ -11,16 +11,103 @@ from hub2labhook.github.client import (
     GITHUB_STATUS_MAP,
 )
 from hub2labhook.exception import Unexpected
+from hub2labhook.github import checkruns
 
 logger = logging.getLogger(__name__)
 
+# Position of the GitLab statuses in the lifecycle of a job or a pipeline
+GITLAB_STATUS_RANK = {
+    "created": 0,
+    "manual": 1,
+    "scheduled": 1,
+    "waiting_for_resource": 2,
+    "preparing": 3,
+    "pending": 4,
+    "running": 5,
+    "success": 6,
+    "failed": 6,
+    "allow_failure": 6,
+    "warning": 6,
+    "canceled": 6,
+    "skipped": 6,
+}
+
+# Fields of the GitLab hooks read by CheckStatus, the rest isn't passed to
+# the tasks. (name, fields) keeps a subset of a nested object or list.
+COMPACT_FIELDS = {
+    "build": (
+        "object_kind",
+        ("commit", ("message",)),
+        "build_id",
+        "build_name",
+        "build_stage",
+        "build_status",
+        "build_allow_failure",
+        "build_started_at",
+        "build_finished_at",
+        "build_duration",
+        "sha",
+        "ref",
+        "project_id",
+        ("repository", ("homepage",)),
+    ),
+    "pipeline": (
+        "object_kind",
+        ("commit", ("message",)),
+        (
+            "object_attributes",
+            (
+                "id",
+                "sha",
+                "ref",
+                "status",
+                "detailed_status",
+                "duration",
+                "created_at",
+                "finished_at",
+                "source",
+                "variables",
+            ),
+        ),
+        ("project", ("id", "web_url")),
+        (
+            "builds",
+            ("id", "name", "stage", "status", "created_at", "started_at", "finished_at"),
+        ),
+    ),
+}
+
+
+def _pick(obj, fields):
+    if isinstance(obj, list):
+        return [_pick(item, fields) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    picked = {}
+    for field in fields:
+        if isinstance(field, tuple):
+            name, subfields = field
+            if name in obj:
+                picked[name] = _pick(obj[name], subfields)
+        elif field in obj:
+            picked[field] = obj[field]
+    return picked
+
 
 class CheckStatus(object):
     def __init__(self, obj):
         self.object = obj
+        self._sha = None
         if self.object_kind not in ["pipeline", "build"]:
             raise Unexpected("Object kind unknown %s" % self.object_kind)
 
+    @classmethod
+    def compact(cls, obj):
+        """Returns the GitLab hook reduced to the fields read by CheckStatus"""
+        if obj.get("object_kind") not in COMPACT_FIELDS:
+            raise Unexpected("Object kind unknown %s" % obj.get("object_kind"))
+        return _pick(obj, COMPACT_FIELDS[obj["object_kind"]])
+
     @classmethod
     def ztime(cls, timestr=None):
         if timestr is None:
@@ -101,12 +188,31 @@ class CheckStatus(object):
         return self.build_url(build_id) + "/trace"
 
     @property
-    def sha(self):
+    def ci_sha(self):
         if self.object_kind == "pipeline":
             return self.object["object_attributes"]["sha"]
         else:
             return self.object["sha"]
 
+    @property
+    def sha(self):
+        """The GitHub sha, differs from ci_sha when a generated commit was pushed"""
+        if self._sha is None:
+            # the SHA variable of the pipelines triggered by the sync
+            for variable in self.variables:
+                if variable.get("key") == "SHA":
+                    self._sha = variable["value"]
+                    return self._sha
+            message = self.object.get("commit", {}).get("message", None)
+            self._sha = checkruns.github_sha(self.ci_sha, message)
+        return self._sha
+
+    @property
+    def variables(self):
+        if self.object_kind == "pipeline":
+            return self.object["object_attributes"].get("variables", None) or []
+        return []
+
     @property
     def ref(self):
         if self.object_kind == "pipeline":
@@ -159,6 +265,11 @@ class CheckStatus(object):
             return split[2]
         return ref
 
+    @property
+    def check_key(self):
+        """Identifies the GitLab object, and so its GitHub check-run"""
+        return "%s:%s:%s" % (self.project_id, self.object_kind, self.object_id)
+
     @property
     def external_id(self):
         return {
@@ -261,6 +372,35 @@ class CheckStatus(object):
         else:
             return self.object["object_attributes"]["status"]
 
+    @property
+    def status_rank(self):
+        return GITLAB_STATUS_RANK.get(self.gitlab_status, 0)
+
+    @property
+    def attempt(self):
+        """Identifies a run of the object. A retried pipeline keeps its id but
+        creates new jobs: its latest job creation time. A retried job has a new id"""
+        if self.object_kind != "pipeline":
+            return ""
+        created = [
+            self.ztime(build["created_at"])
+            for build in self.object.get("builds", [])
+            if build.get("created_at")
+        ]
+        return max(created) if created else ""
+
+    @property
+    def state_order(self):
+        """Sortable position of the event in the lifecycle of its job/pipeline:
+        a later attempt wins, then the most advanced status, then the later
+        timestamps between events of the same status"""
+        return "%s|%02d|%s|%s" % (
+            self.attempt,
+            self.status_rank,
+            self.finished_at or "",
+            self.started_at or "",
+        )
+
     def render_pipeline_status(self):
         context = FFCONFIG.github["context-status"]
         state = GITHUB_STATUS_MAP[self.gitlab_status]
@@ -324,7 +464,9 @@ class CheckStatus(object):
             "The <a href='{build_url}'>Build</a> {build_status}."
         ).format(
             build_url=self.details_url,
-            build_icon=GITHUB_CHECK_ICONS[self.gitlab_status],
+            build_icon=GITHUB_CHECK_ICONS.icon(
+                self.gitlab_status, seed=self.check_key
+            ),
             build_status=title_map[self.gitlab_status],
         )
         return text
@@ -361,7 +503,9 @@ class CheckStatus(object):
             build_url=build_info["build_url"],
             duration=pretty_time_delta(build_info["build_duration"]),
             build_id=build_info["build_id"],
-            build_icon=GITHUB_CHECK_ICONS[build_info["build_status"]],
+            build_icon=GITHUB_CHECK_ICONS.icon(
+                build_info["build_status"], seed=build_info["build_id"]
+            ),
             build_status=status,
         )
         return row
@@ -414,7 +558,9 @@ class CheckStatus(object):
             "The <a href='{build_url}'>Pipeline</a> {build_status}."
         ).format(
             build_url=self.details_url,
-            build_icon=GITHUB_CHECK_ICONS[self.gitlab_status],
+            build_icon=GITHUB_CHECK_ICONS.icon(
+                self.gitlab_status, seed=self.check_key
+            ),
             build_status=title_map[self.gitlab_status],
         )
         return text
@@ -434,13 +580,16 @@ class CheckStatus(object):
             icon = "success_check"
         build_array = []
         for build in self.object["builds"]:
+            # no live duration of the running builds: the text of an unchanged
+            # pipeline must stay the same to skip its update
+            duration = None
+            if build["finished_at"] is not None:
+                duration = self.duration(build["started_at"], build["finished_at"])
             build_info = {
                 "build_stage": build["stage"],
                 "build_name": build["name"],
                 "build_url": self.build_url(build["id"]),
-                "build_duration": self.duration(
-                    build["started_at"], build["finished_at"]
-                ),
+                "build_duration": duration,
                 "build_id": build["id"],
                 "build_status": build["status"],
             }
@@ -0,0 +1,75 @@
+"""
+Compact form of a GitHub event, passed to the tasks instead of the hook.
+
+A pull_request or push hook weighs tens to hundreds of KB, while a build
+reads a dozen of its fields. The envelope holds those fields only, extracted
+once by `GithubEvent`, and is versioned: a worker refuses an envelope it
+doesn't know instead of building the wrong ref. Raw hooks (e.g. tasks
+enqueued by an older release) are still accepted by `load_event`.
+"""
+
+from hub2labhook.exception import Unsupported
+from hub2labhook.github.models.event import GithubEvent
+
+ENVELOPE_VERSION = 1
+
+# Properties of GithubEvent carried by the envelope. The ones unsupported by
+# the event type are None.
+ENVELOPE_FIELDS = (
+    "event_type",
+    "action",
+    "repo",
+    "head_sha",
+    "ref",
+    "refname",
+    "target_refname",
+    "pr_id",
+    "labels",
+    "installation_id",
+    "clone_url",
+    "commit_message",
+    "commit_url",
+    "user",
+)
+
+
+def envelope(gevent: GithubEvent) -> dict:
+    """Extracts the envelope of a GitHub event"""
+    data = {"v": ENVELOPE_VERSION}
+    for field in ENVELOPE_FIELDS:
+        try:
+            data[field] = getattr(gevent, field)
+        except (Unsupported, KeyError, IndexError, TypeError):
+            data[field] = None
+    return data
+
+
+def is_envelope(event) -> bool:
+    return isinstance(event, dict) and "v" in event and "event_type" in event
+
+
+class EventEnvelope(object):
+    """Reads an envelope with the interface of GithubEvent"""
+
+    def __init__(self, data):
+        if data.get("v") != ENVELOPE_VERSION:
+            raise Unsupported(
+                "unsupported event envelope: %s" % data.get("v"),
+                {"version": data.get("v")},
+            )
+        self.data = data
+
+    def __getattr__(self, name):
+        if name in ENVELOPE_FIELDS:
+            return self.data[name]
+        raise AttributeError(name)
+
+    def envelope(self) -> dict:
+        return self.data
+
+
+def load_event(event, headers=None):
+    """Returns the GithubEvent or EventEnvelope of a task argument"""
+    if is_envelope(event):
+        return EventEnvelope(event)
+    return GithubEvent(event, headers or {})
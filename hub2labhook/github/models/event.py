@@ -25,7 +25,7 @@ class GithubEvent(object):
     @property
     def labels(self):
         if self.event_type == "pull_request":
-            labels = [x["name"] for x in self.event["pull_request"]["labels"]]
+            labels = [x["name"] for x in self.event["pull_request"].get("labels", [])]
         else:
             return []
         return labels
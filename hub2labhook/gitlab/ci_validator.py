@@ -0,0 +1,144 @@
+"""
+Offline validation of the structure of a .gitlab-ci.yml.
+
+Catches the obvious mistakes (unknown stage, job without script, broken
+`extends`/`include`) in the worker, before the CI file is sent to the GitLab
+/ci/lint API. It is a first pass, not a replacement: a file that passes
+locally is still linted by GitLab.
+"""
+
+# Top-level keys that aren't jobs
+GITLAB_CI_KEYS = set(
+    [
+        "before_script",
+        "image",
+        "services",
+        "after_script",
+        "variables",
+        "stages",
+        "types",
+        "cache",
+        "include",
+        "workflow",
+        "default",
+    ]
+)
+
+DEFAULT_STAGES = [".pre", "build", "test", "deploy", ".post"]
+
+# A job runs a script, triggers a downstream pipeline or runs a pages deployment
+JOB_ACTIONS = ("script", "trigger", "run")
+
+INCLUDE_TYPES = ("local", "file", "remote", "template", "project", "component")
+
+
+def _is_script(value):
+    if isinstance(value, str):
+        return True
+    if isinstance(value, list):
+        return all(_is_script(line) for line in value)
+    return False
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _validate_include(include):
+    errors = []
+    for item in _as_list(include):
+        if isinstance(item, str):
+            continue
+        if not isinstance(item, dict) or not any(k in item for k in INCLUDE_TYPES):
+            errors.append(
+                "include: %r must be a path or a mapping with one of %s"
+                % (item, ", ".join(INCLUDE_TYPES))
+            )
+    return errors
+
+
+def _resolve(name, jobs, seen=None):
+    """Returns the job merged with the templates it extends, raises
+    ValueError on an unknown or cyclic reference and TypeError on a
+    reference that isn't a name"""
+    seen = seen or []
+    if name in seen:
+        raise ValueError(
+            "%s: circular extends: %s" % (seen[0], " -> ".join(seen + [name]))
+        )
+    if name not in jobs or not isinstance(jobs[name], dict):
+        raise ValueError("%s: extends unknown job '%s'" % (seen[-1], name))
+    job = {}
+    for parent in _as_list(jobs[name].get("extends", [])):
+        if not isinstance(parent, str):
+            raise TypeError(
+                "%s: extends must be a job name or a list of job names" % name
+            )
+        job.update(_resolve(parent, jobs, seen + [name]))
+    job.update(jobs[name])
+    return job
+
+
+def validate(content) -> list:
+    """
+    Validates the parsed content of a .gitlab-ci.yml
+
+    Args:
+      content: the parsed CI file
+
+    Returns:
+      (:obj:`list`) the errors found, empty if the file looks valid
+    """
+    if not isinstance(content, dict):
+        return ["the CI file must be a mapping of jobs and settings"]
+    errors = []
+    stages = content.get("stages", content.get("types", DEFAULT_STAGES))
+    if not isinstance(stages, list) or not all(isinstance(s, str) for s in stages):
+        errors.append("stages: must be a list of names")
+        stages = DEFAULT_STAGES
+    stages = set(stages) | set([".pre", ".post"])
+
+    # Templates extended by jobs, the stages, and the jobs overridden here may
+    # come from included files
+    has_include = "include" in content
+    if has_include:
+        errors += _validate_include(content["include"])
+    check_stages = not has_include or "stages" in content or "types" in content
+
+    jobs = {k: v for k, v in content.items() if k not in GITLAB_CI_KEYS}
+    for name, job in sorted(jobs.items()):
+        if not isinstance(job, dict):
+            errors.append(
+                "%s: a job must be a mapping, got %s" % (name, type(job).__name__)
+            )
+            continue
+        if name.startswith("."):
+            # hidden job/template, only used through extends
+            continue
+        try:
+            job = _resolve(name, jobs)
+        except TypeError as e:
+            errors.append(str(e))
+            continue
+        except ValueError as e:
+            if not has_include:
+                errors.append(str(e))
+            continue
+        if not has_include and not any(k in job for k in JOB_ACTIONS):
+            errors.append("%s: a job needs a script or a trigger" % name)
+        if "script" in job and not _is_script(job["script"]):
+            errors.append("%s: script must be a string or a list of strings" % name)
+        for key in ("before_script", "after_script"):
+            if key in job and not _is_script(job[key]):
+                errors.append(
+                    "%s: %s must be a string or a list of strings" % (name, key)
+                )
+        if "stage" in job and not isinstance(job["stage"], str):
+            errors.append("%s: stage must be a name" % name)
+        elif check_stages and "stage" in job and job["stage"] not in stages:
+            errors.append(
+                "%s: stage '%s' isn't declared in stages" % (name, job["stage"])
+            )
+    return errors
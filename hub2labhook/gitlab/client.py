@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import time
 import json
 import urllib.parse
@@ -7,10 +8,86 @@ import requests
 
 import hub2labhook
 
+from hub2labhook import metrics, transport
+from hub2labhook.cache import LRUCache, SharedCache
 from hub2labhook.config import FailFastConfig, FFCONFIG
+from hub2labhook.exception import Unexpected
 
 API_VERSION = "/api/v4"
 
+# (gitlab endpoint, project id or lowercased 'namespace/name') -> project
+# Shared by all the clients of the process, entries are dropped on 404
+PROJECTS = LRUCache(maxsize=1024, ttl=FFCONFIG.gitlab["project_cache_ttl"])
+
+# "gitlab endpoint:project id" -> {"installation_id": str, "github_repo": str}
+GITHUB_TARGETS = SharedCache("ffci:gitlab:github-target", ttl=86400, maxsize=2048)
+
+# sha256 of "gitlab endpoint" + CI file content -> /ci/lint response
+LINT_RESULTS = SharedCache(
+    "ffci:gitlab:lint", ttl=FFCONFIG.gitlab["lint_cache_ttl"], maxsize=1024
+)
+
+# "gitlab endpoint:project id" of the projects with their initial branches
+INITIALIZED_PROJECTS = SharedCache(
+    "ffci:gitlab:initialized", ttl=30 * 86400, maxsize=4096
+)
+
+# Readiness polling of a new project: first delay and total wait, in seconds
+POLL_DELAY = 0.25
+POLL_TIMEOUT = 60
+# Statuses of a project still being created, the others are raised at once
+POLL_RETRY_STATUSES = (404, 409)
+
+
+def _not_ready(error):
+    status = error.response.status_code if error.response is not None else None
+    return status is None or status in POLL_RETRY_STATUSES or status >= 500
+
+
+def poll(func, timeout=POLL_TIMEOUT, delay=POLL_DELAY):
+    """Calls `func` until it returns something else than None, doubling the
+    delay between calls. HTTP 404, 409 and 5xx mean 'not ready yet', the last
+    one is raised if it isn't ready within `timeout` seconds"""
+    deadline = time.time() + timeout
+    while True:
+        error = None
+        try:
+            result = func()
+            if result is not None:
+                return result
+        except requests.exceptions.HTTPError as e:
+            if not _not_ready(e):
+                raise
+            error = e
+        if time.time() + delay > deadline:
+            if error is not None:
+                raise error
+            raise Unexpected("GitLab not ready after %ss" % timeout)
+        time.sleep(delay)
+        delay *= 2
+
+
+def project_key(project_id):
+    """Normalizes a project id, 'namespace/name' or 'namespace%2fname' to a cache key"""
+    if isinstance(project_id, int):
+        return project_id
+    project_id = str(project_id)
+    if project_id.isdigit():
+        return int(project_id)
+    return urllib.parse.unquote(project_id).lower()
+
+
+def project_not_found(resp):
+    """True if GitLab answered that the project itself doesn't exist, not a
+    resource of the project (variable, job, branch...)"""
+    if resp.status_code != 404:
+        return False
+    try:
+        body = resp.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("message") == "404 Project Not Found"
+
 
 class GitlabClient(object):
     def __init__(
@@ -45,15 +122,20 @@ class GitlabClient(object):
             "url": self.config.gitlab["webhook_url"],
         }
         path = self._url("/projects/%s/hooks" % project_id)
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(body).encode(),
             headers=self.headers,
             timeout=self.config.gitlab["timeout"],
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp
 
+    @property
+    def session(self):
+        """The pooled session of the gitlab instance"""
+        return transport.session(self.endpoint, timeout=self.config.gitlab["timeout"])
+
     @property
     def headers(self):
         """Configure requests headers with the private token"""
@@ -66,25 +148,61 @@ class GitlabClient(object):
         return self._headers
 
     def gitlabci_lint(self, data):
+        """Lints a CI file, the verdict is cached per endpoint and file content"""
+        key = hashlib.sha256(
+            (self.endpoint + "\n" + data).encode("utf-8")
+        ).hexdigest()
+        result = LINT_RESULTS.get(key)
+        if result is not None:
+            metrics.incr("gitlab_lint_cache_hits")
+            return result
+        metrics.incr("gitlab_lint_cache_misses")
         path = self._url("/ci/lint")
-        resp = requests.post(
+        resp = self.session.post(
             path,
             json={"content": data},
             headers=self.headers,
             timeout=self.config.gitlab["timeout"],
         )
-        return resp.json()
+        result = resp.json()
+        # Only verdicts are cached, not errors (auth, rate limit...)
+        if resp.ok and "status" in result:
+            LINT_RESULTS.set(key, result)
+        return result
+
+    def _cache_project(self, project):
+        PROJECTS.set((self.endpoint, project["id"]), project)
+        PROJECTS.set((self.endpoint, project["path_with_namespace"].lower()), project)
+        return project
+
+    def forget_project(self, project_id):
+        """Drops a project from the cache, by id or by name"""
+        project = PROJECTS.get((self.endpoint, project_key(project_id)))
+        PROJECTS.delete((self.endpoint, project_key(project_id)))
+        if project is not None:
+            INITIALIZED_PROJECTS.delete("%s:%s" % (self.endpoint, project["id"]))
+            PROJECTS.delete((self.endpoint, project["id"]))
+            PROJECTS.delete((self.endpoint, project["path_with_namespace"].lower()))
+
+    def _raise_for_status(self, resp, project_id=None):
+        """raise_for_status, forgetting the cached project if GitLab doesn't know it anymore"""
+        if project_id is not None and project_not_found(resp):
+            self.forget_project(project_id)
+        resp.raise_for_status()
 
     def get_project(self, project_id):
         """Returns the gitlab project dict
         link: https://docs.gitlab.com/ce/api/projects.html#get-single-project
         """
+        project = PROJECTS.get((self.endpoint, project_key(project_id)))
+        if project is not None:
+            return project
         path = self._url("/projects/%s" % project_id)
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
-        return resp.json()
+        self._raise_for_status(resp, project_id)
+        return self._cache_project(resp.json())
 
     def get_project_id(self, project_name=None):
         """Requests the project-id (int) from a project_name (str)"""
@@ -99,20 +217,20 @@ class GitlabClient(object):
 
     def get_variables(self, project_id):
         path = self._url("/projects/%s/variables" % self.get_project_id(project_id))
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_variable(self, project_id, key):
         path = self._url(
             "/projects/%s/variables/%s" % (self.get_project_id(project_id), key)
         )
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def set_variables(self, project_id, variables):
@@ -120,29 +238,58 @@ class GitlabClient(object):
         path = self._url("/projects/%s/variables" % self.get_project_id(project_id))
         for key, value in variables.items():
             key_path = path + "/%s" % key
-            resp = requests.get(key_path, headers=self.headers)
+            resp = self.session.get(key_path, headers=self.headers)
             action = "post"
+            action_path = path
             if resp.status_code == 200:
                 if resp.json()["value"] == value:
                     continue
                 action = "put"
-                path = key_path
+                action_path = key_path
 
             body = {"key": key, "value": value}
 
-            resp = getattr(requests, action)(
-                path, data=json.dumps(body), headers=self.headers
+            resp = getattr(self.session, action)(
+                action_path, data=json.dumps(body), headers=self.headers
             )
-            resp.raise_for_status()
+            self._raise_for_status(resp, project_id)
+
+    def get_github_target(self, project_id):
+        """Returns the GitHub installation and repository a project is synced from,
+        as stored in its GITHUB_INSTALLATION_ID and GITHUB_REPO variables"""
+        key = "%s:%s" % (self.endpoint, project_id)
+        target = GITHUB_TARGETS.get(key)
+        if target is None:
+            target = {
+                "installation_id": self.get_variable(
+                    project_id, "GITHUB_INSTALLATION_ID"
+                )["value"],
+                "github_repo": self.get_variable(project_id, "GITHUB_REPO")["value"],
+            }
+            GITHUB_TARGETS.set(key, target)
+        return target
+
+    def set_github_target(self, project_id, installation_id, github_repo):
+        """Stores the GitHub installation and repository in the project variables"""
+        target = {"installation_id": str(installation_id), "github_repo": github_repo}
+        self.set_variables(
+            project_id,
+            {
+                "GITHUB_INSTALLATION_ID": target["installation_id"],
+                "GITHUB_REPO": target["github_repo"],
+            },
+        )
+        GITHUB_TARGETS.set("%s:%s" % (self.endpoint, project_id), target)
+        return target
 
     def get_job(self, project_id, job_id):
         path = self._url(
             "/projects/%s/jobs/%s" % (self.get_project_id(project_id), job_id)
         )
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_statuses(self, project_id, sha):
@@ -150,10 +297,10 @@ class GitlabClient(object):
             "/projects/%s/repository/commits/%s/statuses"
             % (self.get_project_id(project_id), sha)
         )
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_jobs(self, project_id, pipeline_id):
@@ -161,10 +308,10 @@ class GitlabClient(object):
             "/projects/%s/pipelines/%s/jobs"
             % (self.get_project_id(project_id), pipeline_id)
         )
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def cancel_pipeline(self, project_id, pipeline_id):
@@ -172,10 +319,10 @@ class GitlabClient(object):
             "/projects/%s/pipelines/%s/cancel"
             % (self.get_project_id(project_id), pipeline_id)
         )
-        resp = requests.post(
+        resp = self.session.post(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def new_pipeline(
@@ -196,13 +343,13 @@ class GitlabClient(object):
             "ref": ref,
             "variables": fmt_vars,
         }
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(body).encode(),
             headers=self.headers,
             timeout=self.config.gitlab["timeout"],
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
 
         return resp.json()
 
@@ -214,28 +361,29 @@ class GitlabClient(object):
 
         if sha:
             params["sha"] = sha
-        resp = requests.get(
+        resp = self.session.get(
             path,
             headers=self.headers,
             params=params,
             timeout=self.config.gitlab["timeout"],
         )
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_pipeline_status(self, project_id, pipeline_id):
         path = self._url(
             "/projects/%s/pipelines/%s" % (self.get_project_id(project_id), pipeline_id)
         )
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_namespace_id(self, namespace):
         path = self._url("/namespaces")
         params = {"search": namespace}
-        resp = requests.get(
+        resp = self.session.get(
             path,
             headers=self.headers,
             params=params,
@@ -249,12 +397,15 @@ class GitlabClient(object):
     ):
         group_name = namespace or self.config.gitlab["namespsace"]
         project_path = "%s%%2f%s" % (group_name, project_name)
+        project = PROJECTS.get((self.endpoint, project_key(project_path)))
+        if project is not None:
+            return project
         path = self._url("/projects/%s" % (project_path))
-        resp = requests.get(
+        resp = self.session.get(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
         if resp.status_code == 200:
-            return resp.json()
+            return self._cache_project(resp.json())
         group_id = self.get_namespace_id(group_name)
         path = self._url("/projects")
         body = {
@@ -269,7 +420,7 @@ class GitlabClient(object):
             "visibility": "private",
         }
 
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(body).encode(),
             headers=self.headers,
@@ -277,16 +428,15 @@ class GitlabClient(object):
         )
         resp.raise_for_status()
         _ = self.create_webhooks(resp.json()["id"])
-        return resp.json()
+        return self._cache_project(resp.json())
 
     def push_file(
         self, project_id, file_path, file_content, branch, message, force=True
     ):
-        branch_path = self._url(
-            "/projects/%s/repository/branches" % self.get_project_id(project_id)
-        )
+        project_id = self.get_project_id(project_id)
+        branch_path = self._url("/projects/%s/repository/branches" % project_id)
         branch_body = {"branch": branch, "ref": "_failfastci"}
-        resp = requests.post(
+        resp = self.session.post(
             branch_path,
             params=branch_body,
             headers=self.headers,
@@ -295,7 +445,7 @@ class GitlabClient(object):
 
         path = self._url(
             "/projects/%s/repository/files/%s"
-            % (self.get_project_id(project_id), urllib.parse.quote_plus(file_path))
+            % (project_id, urllib.parse.quote_plus(file_path))
         )
         body = {
             "file_path": file_path,
@@ -304,27 +454,28 @@ class GitlabClient(object):
             "content": base64.b64encode(file_content).decode(),
             "commit_message": message,
         }
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(body),
             headers=self.headers,
             timeout=self.config.gitlab["timeout"],
         )
         if resp.status_code == 400 or resp.status_code == 409:
-            resp = requests.put(
+            resp = self.session.put(
                 path,
                 data=json.dumps(body),
                 headers=self.headers,
                 timeout=self.config.gitlab["timeout"],
             )
 
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def delete_project(self, project_id):
         path = self._url("/projects/%s" % (self.get_project_id(project_id)))
-        resp = requests.delete(path)
-        resp.raise_for_status()
+        resp = self.session.delete(path)
+        self.forget_project(project_id)
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     def get_branches(self, project_id, search=None):
@@ -338,8 +489,8 @@ class GitlabClient(object):
             path = self._url(
                 "/projects/%s/repository/branches" % (self.get_project_id(project_id))
             )
-            resp = requests.get(path, headers=self.headers, params=params)
-            resp.raise_for_status()
+            resp = self.session.get(path, headers=self.headers, params=params)
+            self._raise_for_status(resp, project_id)
             branches += resp.json()
             page_count = resp.headers["X-Total-Pages"]
             if not resp.headers["X-Next-Page"]:
@@ -347,6 +498,20 @@ class GitlabClient(object):
             page = resp.headers["X-Next-Page"]
         return branches
 
+    def get_branch(self, project_id, branch):
+        """Returns the branch dict, None if the branch doesn't exist"""
+        path = self._url(
+            "/projects/%s/repository/branches/%s"
+            % (self.get_project_id(project_id), urllib.parse.quote_plus(branch))
+        )
+        resp = self.session.get(
+            path, headers=self.headers, timeout=self.config.gitlab["timeout"]
+        )
+        if resp.status_code == 404:
+            return None
+        self._raise_for_status(resp, project_id)
+        return resp.json()
+
     def delete_old_branches(self, project_id, branches, days_old):
         from datetime import datetime, timedelta
 
@@ -368,33 +533,37 @@ class GitlabClient(object):
             "/projects/%s/repository/branches/%s"
             % (self.get_project_id(project_id), urllib.parse.quote_plus(branch))
         )
-        resp = requests.delete(
+        resp = self.session.delete(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return True
 
     def initialize_project(self, project_name: str, namespace: str = None):
+        """Returns the project, created with a master and a _failfastci branch
+        if needed. Initialized projects are cached: no extra call afterwards"""
         project = self.get_or_create_project(project_name, namespace)
+        key = "%s:%s" % (self.endpoint, project["id"])
+        if INITIALIZED_PROJECTS.get(key):
+            return project
         branch = "master"
 
-        branch_path = self._url(
-            "/projects/%s/repository/branches/%s" % (project["id"], branch)
-        )
-        resp = requests.get(
-            branch_path, headers=self.headers, timeout=self.config.gitlab["timeout"]
-        )
-        if resp.status_code == 404:
-            time.sleep(2)
-            self.push_file(
-                project["id"],
-                file_path="README.md",
-                file_content=bytes(("# %s" % project_name).encode()),
-                branch="master",
-                message="init readme",
+        if self.get_branch(project["id"], branch) is None:
+            # The repository of a new project isn't ready right away
+            poll(
+                lambda: self.push_file(
+                    project["id"],
+                    file_path="README.md",
+                    file_content=bytes(("# %s" % project_name).encode()),
+                    branch="master",
+                    message="init readme",
+                )
+            )
+            poll(lambda: self.get_branch(project["id"], branch))
+            branch_path = self._url(
+                "/projects/%s/repository/branches/%s" % (project["id"], branch)
             )
-            time.sleep(2)
-            resp = requests.put(
+            resp = self.session.put(
                 branch_path + "/unprotect",
                 headers=self.headers,
                 timeout=self.config.gitlab["timeout"],
@@ -402,29 +571,29 @@ class GitlabClient(object):
             resp.raise_for_status()
             branch_path = self._url("/projects/%s/repository/branches" % project["id"])
             branch_body = {"branch": "_failfastci", "ref": "master"}
-            resp = requests.post(
+            resp = self.session.post(
                 branch_path,
                 params=branch_body,
                 headers=self.headers,
                 timeout=self.config.gitlab["timeout"],
             )
-
+        INITIALIZED_PROJECTS.set(key, True)
         return project
 
     def retry_build(self, gitlab_project_id, build_id):
         path = self._url("/projects/%s/jobs/%s/retry" % (gitlab_project_id, build_id))
-        resp = requests.post(
+        resp = self.session.post(
             path, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, gitlab_project_id)
         return resp.json()
 
     def retry_pipeline(self, project_id, pipeline_id):
         path = self._url(f"/projects/{project_id}/pipeline/{pipeline_id}/retry")
-        resp = requests.post(
+        resp = self.session.post(
             path, params={}, headers=self.headers, timeout=self.config.gitlab["timeout"]
         )
-        resp.raise_for_status()
+        self._raise_for_status(resp, project_id)
         return resp.json()
 
     # TODO(ant31): dead-code
@@ -440,7 +609,7 @@ class GitlabClient(object):
         body = {"token": trigger_token, "ref": project_branch, "variables": variables}
 
         path = self._url("/projects/%s/trigger/builds" % project_id)
-        resp = requests.post(
+        resp = self.session.post(
             path,
             data=json.dumps(body),
             headers=self.headers,
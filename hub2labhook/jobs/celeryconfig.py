@@ -1,9 +1,63 @@
 import os
 
+from kombu import Queue
+
+from hub2labhook.jobs import serializers
+
 broker_url = os.getenv("CELERY_BROKER", "redis://")
 result_backend = os.getenv("CELERY_BACKEND", "redis://")
-task_serializer = "json"
-result_serializer = "json"
-accept_content = ["json"]
+# json, or ffci-msgpack (see hub2labhook.jobs.serializers)
+task_serializer = os.getenv("CELERY_SERIALIZER", "json")
+result_serializer = os.getenv("CELERY_RESULT_SERIALIZER", task_serializer)
+# both are accepted, the serializer can be changed while tasks are queued
+accept_content = ["json"] + ([serializers.NAME] if serializers.available() else [])
 # timezone = 'UTC'
 enable_utc = True
+
+# Queues:
+#  - sync: the git clone/push of a build, minutes each
+#  - status: GitHub/GitLab API calls only (check-runs, statuses, routing)
+#  - admin: actions requested by a user (retry, skip, resync)
+# A burst of syncs can't delay the status updates when they're consumed by
+# different workers (see run-worker.sh).
+task_default_queue = "status"
+task_queues = [
+    Queue("sync", routing_key="sync"),
+    Queue("status", routing_key="status"),
+    Queue("admin", routing_key="admin"),
+    # previous default queue, drained by the workers consuming all the queues
+    Queue("celery", routing_key="celery"),
+]
+
+TASKS = "hub2labhook.jobs.tasks."
+
+# With Redis, 0 is the highest priority
+task_routes = {
+    TASKS + "pipeline": {"queue": "sync", "priority": 6},
+    TASKS + "route_event": {"queue": "status", "priority": 0},
+    TASKS + "update_github_check": {"queue": "status", "priority": 3},
+    TASKS + "flush_gitlab_event": {"queue": "status", "priority": 3},
+    TASKS + "update_pipeline_hook": {"queue": "status", "priority": 3},
+    TASKS + "update_github_statuses_failure": {"queue": "status", "priority": 3},
+    TASKS + "update_github_statuses_not_authorized": {
+        "queue": "status",
+        "priority": 3,
+    },
+    TASKS + "prep_retry_check_suite": {"queue": "status", "priority": 6},
+    TASKS + "prep_retry_comment": {"queue": "status", "priority": 6},
+    TASKS + "prep_retry_failed": {"queue": "status", "priority": 6},
+    TASKS + "update_pipeline_status": {"queue": "admin", "priority": 0},
+    TASKS + "resync_action": {"queue": "admin", "priority": 3},
+    TASKS + "skip_check": {"queue": "admin", "priority": 3},
+    TASKS + "retry_build": {"queue": "admin", "priority": 3},
+}
+
+broker_transport_options = {
+    "priority_steps": [0, 3, 6, 9],
+    # a worker consuming several queues empties them in the order of -Q
+    "queue_order_strategy": "priority",
+}
+
+# A sync holds its worker process for minutes: its workers should prefetch
+# 1 message (CELERY_PREFETCH_MULTIPLIER=1), the status workers can take more.
+worker_prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "4"))
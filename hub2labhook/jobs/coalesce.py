@@ -0,0 +1,74 @@
+"""
+Coalescing of the GitLab hooks of a same job or pipeline.
+
+GitLab sends several hooks per job within seconds (created, pending,
+running, success...). The events are held in Redis for a short window per
+(project, object_kind, object_id) and only the most advanced one is then
+forwarded to GitHub. The flush always reads the latest stored event, so the
+terminal state of a job is never lost.
+"""
+
+import json
+
+from hub2labhook.cache import redis_client
+
+# KEYS: event hash, scheduled flag
+# ARGV: state order, event, expiration (ms)
+# Keeps the most advanced event, returns 1 when a flush must be scheduled
+OFFER_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'order')
+if (not current) or ARGV[1] >= current then
+  redis.call('HSET', KEYS[1], 'order', ARGV[1], 'event', ARGV[2])
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+if redis.call('SET', KEYS[2], '1', 'NX', 'PX', ARGV[3]) then
+  return 1
+end
+return 0
+"""
+
+# KEYS: event hash, scheduled flag
+TAKE_SCRIPT = """
+local event = redis.call('HGET', KEYS[1], 'event')
+redis.call('DEL', KEYS[1], KEYS[2])
+return event
+"""
+
+
+class EventCoalescer(object):
+    namespace = "ffci:coalesce"
+
+    def __init__(self, window: float) -> None:
+        """
+        Args:
+          window (:obj:`float`) seconds the events are held before being forwarded
+        """
+        self.window = window
+        # Outlives the window largely, in case the flush task is late
+        self.expire_ms = int((window * 10 + 300) * 1000)
+
+    def _keys(self, key):
+        return ["%s:%s" % (self.namespace, key), "%s:%s:scheduled" % (self.namespace, key)]
+
+    @property
+    def client(self):
+        return redis_client()
+
+    @property
+    def enabled(self):
+        return bool(self.window) and self.client is not None
+
+    def offer(self, key: str, order: str, event: dict) -> bool:
+        """Stores the event unless a more advanced one is already held.
+        Returns True if no flush is scheduled for this key yet"""
+        res = self.client.eval(
+            OFFER_SCRIPT, 2, *self._keys(key), order, json.dumps(event), self.expire_ms
+        )
+        return res == 1
+
+    def take(self, key: str):
+        """Returns the held event and releases the key, None if nothing is held"""
+        raw = self.client.eval(TAKE_SCRIPT, 2, *self._keys(key))
+        if raw is None:
+            return None
+        return json.loads(raw)
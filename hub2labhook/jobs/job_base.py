@@ -18,8 +18,16 @@ class JobBase(Task):
     def on_success(self, retval, task_id, args, kwargs):
         pass
 
+    def _route(self):
+        return self.app.amqp.router.route({}, self.name)
+
     def task_queue(self):
-        return self._app.amqp.routes[0].route_for_task(self.name)["queue"]
+        """Name of the queue the task is sent to (see celeryconfig.task_routes)"""
+        return self._route()["queue"].name
 
     def task_routing_key(self):
-        return self._app.amqp.routes[0].route_for_task(self.name)["routing_key"]
+        route = self._route()
+        return route.get("routing_key") or route["queue"].routing_key
+
+    def task_priority(self):
+        return self._route().get("priority", None)
@@ -1,8 +1,18 @@
 from __future__ import absolute_import, unicode_literals
 import celery
+from celery.signals import worker_process_init
+
+from hub2labhook import transport
+from hub2labhook.jobs import serializers
+
+# before the configuration, which accepts it
+serializers.register()
 
 app = celery.Celery("failfast-ci", include=["hub2labhook.jobs.tasks"])
 app.config_from_object("hub2labhook.jobs.celeryconfig")
+
+# prefork children must not reuse the HTTP connections of the parent
+worker_process_init.connect(transport.reset_sessions, weak=False)
 # update_conf = {}
 # Optional configuration, see the application user guide.
 # app.conf.update(**update_conf)
@@ -0,0 +1,120 @@
+"""
+Opt-in binary serializer of the task messages: msgpack, compressed above a
+size threshold.
+
+Most payloads are small envelopes, but some still ship whole (e.g. GitLab
+pipeline hooks listing hundreds of builds). msgpack is smaller and faster to
+encode than JSON, and the bodies larger than CELERY_COMPRESS_THRESHOLD bytes
+are compressed with zstd (or zlib when zstandard isn't installed).
+
+Each body starts with one byte telling how it's compressed, so the decoder
+doesn't depend on the configuration of the producer. Dates, UUIDs and
+decimals are encoded as strings: unlike kombu's JSON serializer they aren't
+decoded back.
+
+Enable with CELERY_SERIALIZER=ffci-msgpack once every worker accepts it
+(`pip install hub2lab-hook[msgpack]`): the workers accept it as soon as
+msgpack is installed.
+"""
+
+import datetime
+import decimal
+import logging
+import os
+import uuid
+import zlib
+
+from kombu.serialization import register as register_serializer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+NAME = "ffci-msgpack"
+CONTENT_TYPE = "application/x-ffci-msgpack"
+
+COMPRESS_THRESHOLD = int(os.getenv("CELERY_COMPRESS_THRESHOLD", "4096"))
+COMPRESSION = os.getenv("CELERY_COMPRESSION", "zstd")
+
+# First byte of a body
+RAW = b"\x00"
+ZLIB = b"\x01"
+ZSTD = b"\x02"
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def available() -> bool:
+    return msgpack is not None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    raise TypeError("Cannot serialize %r" % type(obj))
+
+
+def compressor(compression):
+    """Returns (header, compress function) of a compression name"""
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard isn't installed, messages compressed with zlib")
+        compression = "zlib"
+    if compression == "zstd":
+        return ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    if compression == "zlib":
+        return ZLIB, lambda data: zlib.compress(data, ZLIB_LEVEL)
+    if compression in ("none", ""):
+        return RAW, None
+    raise ValueError("Unknown compression %s" % compression)
+
+
+def dumps(obj, threshold=COMPRESS_THRESHOLD, compression=COMPRESSION) -> bytes:
+    """
+    Args:
+      obj: the message body
+      threshold (:obj:`int`) bodies larger than `threshold` bytes are compressed
+      compression (:obj:`str`) zstd, zlib or none
+    """
+    data = msgpack.packb(obj, use_bin_type=True, default=_default)
+    header, compress = compressor(compression)
+    if compress is None or len(data) <= threshold:
+        return RAW + data
+    return header + compress(data)
+
+
+def loads(data):
+    data = bytes(data)
+    header, body = data[:1], data[1:]
+    if header == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstandard isn't installed, can't decode the message")
+        # the frames written by compress() hold the content size
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif header == ZLIB:
+        body = zlib.decompress(body)
+    elif header != RAW:
+        raise ValueError("Unknown message header %r" % header)
+    return msgpack.unpackb(body, raw=False)
+
+
+def register() -> bool:
+    """Registers the serializer with kombu, returns False if msgpack is missing"""
+    if not available():
+        return False
+    # checked once at startup rather than on the first large message
+    compressor(COMPRESSION)
+    register_serializer(
+        NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary"
+    )
+    return True
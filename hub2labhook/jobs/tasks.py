@@ -3,9 +3,15 @@ import logging
 import re
 import json
 
+import redis
 import requests
+from hub2labhook.cache import redis_failed
 from hub2labhook.github.models.event import GithubEvent
 from hub2labhook.github.models.check import CheckStatus
+from hub2labhook.github.models.envelope import envelope, load_event
+from hub2labhook.github import checkruns
+from hub2labhook.github.checkruns import advance_state, publish_check
+from hub2labhook import metrics
 
 from hub2labhook.github.client import GITHUB_STATUS_MAP, GithubClient
 from hub2labhook.gitlab.client import GitlabClient
@@ -14,6 +20,7 @@ from hub2labhook.config import FFCONFIG
 
 from hub2labhook.jobs.runner import app
 from hub2labhook.jobs.job_base import JobBase
+from hub2labhook.jobs.coalesce import EventCoalescer
 
 logger = logging.getLogger(__name__)
 
@@ -108,27 +115,90 @@ def istriggered_on_pr(gevent, config=None):
     )
 
 
-@app.task(base=JobBase, retry_kwargs={"max_retries": 5}, retry_backoff=True)
+@app.task(
+    base=JobBase,
+    autoretry_for=(requests.exceptions.RequestException,),
+    retry_kwargs={"max_retries": 5},
+    retry_backoff=True,
+)
 def update_github_check(event):
     ### From a Gitlab event, update the GitHub check status
     gitlabclient = GitlabClient()
     checkstatus = CheckStatus(event)
-    installation_id = gitlabclient.get_variable(
-        checkstatus.project_id, "GITHUB_INSTALLATION_ID"
-    )["value"]
-    github_repo = gitlabclient.get_variable(checkstatus.project_id, "GITHUB_REPO")[
-        "value"
-    ]
-    githubclient = GithubClient(installation_id=installation_id)
+    target = gitlabclient.get_github_target(checkstatus.project_id)
+    github_repo = target["github_repo"]
+    githubclient = GithubClient(installation_id=target["installation_id"])
 
     # Skip queued builds as they could be 'manual'
     if checkstatus.status == "queued" and checkstatus.object_kind == "build":
         return None
+    # claimed before the update: an older event processed concurrently is
+    # dropped instead of overwriting a more advanced state. A retry of the
+    # same event passes the claim again.
+    if not advance_state(checkstatus):
+        logger.info(
+            "Dropping out-of-order event %s: %s",
+            checkstatus.check_key,
+            checkstatus.gitlab_status,
+        )
+        metrics.incr("github_check_stale_updates_suppressed")
+        return None
     if checkstatus.object_kind == "pipeline" and not checkstatus.ischild():
-        githubclient.post_status(
-            checkstatus.render_pipeline_status(), github_repo, checkstatus.sha
+        checkruns.post_status(
+            githubclient,
+            checkstatus.render_pipeline_status(),
+            github_repo,
+            checkstatus.sha,
+        )
+    return publish_check(
+        githubclient, github_repo, checkstatus, checkstatus.render_check()
+    )
+
+
+@app.task(bind=True, base=JobBase, retry_kwargs={"max_retries": 5})
+def flush_gitlab_event(self, key):
+    """Forwards the latest event held by the coalescer for a job/pipeline"""
+    coalescer = EventCoalescer(FFCONFIG.failfast["coalesce_window"])
+    event = coalescer.take(key)
+    if event is None:
+        return None
+    try:
+        return update_github_check(event)
+    except requests.exceptions.RequestException as exc:
+        # The event was taken: hold it again, unless a newer one arrived in
+        # the meantime, so the terminal state isn't lost
+        try:
+            scheduled = coalescer.offer(key, CheckStatus(event).state_order, event)
+        except redis.exceptions.RedisError as redis_exc:
+            redis_failed(redis_exc)
+            return update_github_check.apply_async((event,), countdown=60)
+        if not scheduled:
+            # flushed by the task scheduled with the newer event
+            return None
+        raise self.retry(
+            exc=exc, countdown=max(coalescer.window, 1) * 2**self.request.retries
         )
-    return githubclient.create_check(github_repo, checkstatus.render_check())
+
+
+def coalesce_gitlab_event(event):
+    """
+    Holds the GitLab hooks of a job/pipeline for `coalesce_window` seconds,
+    only its most advanced state is then sent to GitHub.
+    Returns the scheduled job, None if the event joined an already scheduled one
+    """
+    event = CheckStatus.compact(event)
+    coalescer = EventCoalescer(FFCONFIG.failfast["coalesce_window"])
+    if coalescer.enabled:
+        checkstatus = CheckStatus(event)
+        try:
+            if coalescer.offer(checkstatus.check_key, checkstatus.state_order, event):
+                return flush_gitlab_event.apply_async(
+                    (checkstatus.check_key,), countdown=coalescer.window
+                )
+            return None
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+    return update_github_check.delay(event)
 
 
 # @TODO: retry for tags and branches (e.g. main). this code handle only PR
@@ -144,7 +214,7 @@ def prep_retry_check_suite(event):
     event["number"] = pr_id
     pull = githubclient.get_json(pull_url)
     event["pull_request"] = pull
-    return event
+    return envelope(GithubEvent(event, {"X-GITHUB-EVENT": "pull_request"}))
 
 
 # @TODO: retry for tags and branches (e.g. main). this code handle only PR
@@ -155,7 +225,7 @@ def prep_retry_comment(event):
     pull = githubclient.get_json(pull_url)
     event["number"] = pull["number"]
     event["pull_request"] = pull
-    return event
+    return envelope(GithubEvent(event, {"X-GITHUB-EVENT": "pull_request"}))
 
 
 # @TODO: retry for tags and branches (e.g. main). this code handle only PR
@@ -168,25 +238,30 @@ def prep_retry_failed(event, pull_url):
     githubclient.rerequest_failed_run(
         pull["base"]["repo"]["full_name"], pull["head"]["sha"]
     )
-    return event
+    return envelope(GithubEvent(event, {"X-GITHUB-EVENT": "pull_request"}))
 
 
 @app.task(base=JobBase, retry_kwargs={"max_retries": 5}, retry_backoff=True)
-def pipeline(event, headers):
-    gevent = GithubEvent(event, headers)
+def pipeline(event, headers=None, force=False):
+    """
+    Args:
+      event (:obj:`dict`) envelope of the event, or the raw GitHub hook
+      headers (:obj:`dict`) headers of the raw hook, unused with an envelope
+    """
+    gevent = load_event(event, headers)
     config = FFCONFIG
-    build = Pipeline(gevent, config)
+    build = Pipeline(gevent, config, force=force)
     return build.trigger_pipeline()
 
 
 @app.task(base=JobBase)
-def update_github_statuses_not_authorized(event, headers):
+def update_github_statuses_not_authorized(event, headers=None):
 
     config = FFCONFIG
     labels = []
     if "required-labels" in config.failfast["build"]:
         labels = config.failfast["build"]["required-labels"]
-    gevent = GithubEvent(event, headers)
+    gevent = load_event(event, headers)
     githubclient = GithubClient(gevent.installation_id)
     body = dict(
         state=GITHUB_STATUS_MAP["canceled"],
@@ -198,9 +273,9 @@ def update_github_statuses_not_authorized(event, headers):
 
 
 @app.task(base=JobBase)
-def update_github_statuses_failure(request, exc, traceback, event, headers):
+def update_github_statuses_failure(request, exc, traceback, event, headers=None):
     """The pipeline has failed. Notify GitHub."""
-    gevent = GithubEvent(event, headers)
+    gevent = load_event(event, headers)
     githubclient = GithubClient(gevent.installation_id)
     body = dict(
         state=GITHUB_STATUS_MAP["canceled"],
@@ -222,13 +297,11 @@ def post_pipeline_status(project, pipeline_attr):
         "failure": "Pipeline failed",
     }
     gitlabclient = GitlabClient()
-    installation_id = gitlabclient.get_variable(
-        project["id"], "GITHUB_INSTALLATION_ID"
-    )["value"]
-    github_repo = gitlabclient.get_variable(project["id"], "GITHUB_REPO")["value"]
+    target = gitlabclient.get_github_target(project["id"])
+    github_repo = target["github_repo"]
 
-    githubclient = GithubClient(installation_id=installation_id)
-    sha = pipeline_attr["sha"]
+    githubclient = GithubClient(installation_id=target["installation_id"])
+    sha = checkruns.github_sha(pipeline_attr["sha"])
     context = FFCONFIG.github["context"]
     state = GITHUB_STATUS_MAP[pipeline_attr["status"]]
     pipeline_body = {
@@ -244,8 +317,8 @@ def post_pipeline_status(project, pipeline_attr):
         "description": "resync-gitlab status",
         "context": "%s/resync-gitlab" % context,
     }
-    githubclient.post_status(resync_body, github_repo, sha)
-    return githubclient.post_status(pipeline_body, github_repo, sha)
+    checkruns.post_status(githubclient, resync_body, github_repo, sha)
+    return checkruns.post_status(githubclient, pipeline_body, github_repo, sha)
 
 
 @app.task(base=JobBase, retry_kwargs={"max_retries": 5}, retry_backoff=True)
@@ -397,8 +470,12 @@ def resync_action(self, event):
         check.update(result)
 
         githubclient = GithubClient(installation_id=event["installation"]["id"])
-        return githubclient.update_check_run(
-            event["repository"]["full_name"], check, event["check_run"]["id"]
+        return checkruns.update_check_run(
+            githubclient,
+            event["repository"]["full_name"],
+            check,
+            event["check_run"]["id"],
+            ignore=("completed_at",),
         )
     except requests.exceptions.RequestException as exc:
         logger.error("Error request")
@@ -418,8 +495,10 @@ def start_pipeline(event, headers):
         or istriggered_on_labels(gevent, config)
     )
     if trigger_build:
-        task = pipeline.s(event, headers)
-        task.link_error(update_github_statuses_failure.s(event, headers))
+        # the tasks carry the envelope, not the hook
+        compact = envelope(gevent)
+        task = pipeline.s(compact)
+        task.link_error(update_github_statuses_failure.s(compact))
         return task
     else:
         logger.info(
@@ -430,5 +509,50 @@ def start_pipeline(event, headers):
             istriggered_on_labels(gevent, config),
         )
         if required_labels(gevent, config):
-            update_github_statuses_not_authorized(event, headers).apply_async()
+            update_github_statuses_not_authorized.delay(envelope(gevent))
         return None
+
+
+def github_event_job(params, headers):
+    """Returns the task signature handling a GitHub event, None to ignore it"""
+    gevent = GithubEvent(params, headers)
+    job = None
+    if gevent.event_type == "check_run" and gevent.action == "rerequested":
+        job = retry_build.s(gevent.external_id, gevent.head_sha)
+    elif gevent.event_type == "check_run" and gevent.action == "requested_action":
+        job = request_action(gevent.event["requested_action"]["identifier"], params)
+    elif gevent.event_type == "check_suite" and gevent.action == "rerequested":
+        params["prev_action"] = params["action"]
+        params["action"] = "synchronize"
+        job = prep_retry_check_suite.s(params) | pipeline.s()
+    elif (
+        gevent.event_type == "issue_comment"
+        and gevent.action == "created"
+        and "pull_request" in gevent.event["issue"]
+    ):
+        comment = gevent.event["comment"]["body"]
+        if re.search("^.*\\/retest-failed( .*|$)", comment) is not None:
+            pull_url = gevent.event["issue"]["pull_request"]["url"]
+            job = prep_retry_failed.s(params, pull_url)
+        elif re.search("^.*\\/retest( .*|$)", comment) is not None:
+            params["prev_action"] = params["action"]
+            params["action"] = "synchronize"
+            # '/retest --force' syncs again even if GitLab already runs the sha
+            force = re.search("\\/retest --force( .*|$)", comment) is not None
+            job = prep_retry_comment.s(params) | pipeline.s(force=force)
+    elif gevent.event_type in ["push", "pull_request"]:
+        job = start_pipeline(params, headers)
+    return job
+
+
+@app.task(base=JobBase)
+def route_event(body, headers):
+    """
+    Decides what to do with a GitHub delivery. The API only verifies and
+    enqueues the raw body, all the parsing and trigger rules run here.
+    """
+    params = json.loads(body)
+    job = github_event_job(params, dict(headers))
+    if job is None:
+        return {"ignored": True, "event": headers.get("X-GitHub-Event", None)}
+    return {"job_id": job.delay().id}
@@ -0,0 +1,187 @@
+"""
+Evaluation of a .failfast-ci.jsonnet into the GitLab CI document.
+
+The imports are found statically and fetched beforehand (from GitHub, at the
+built sha), so the evaluation itself reads neither the disk nor the network.
+The output is cached by a hash of all the sources: builds of an unchanged
+configuration don't evaluate it again.
+
+The evaluation runs in a child process, killed after `timeout` seconds: a
+jsonnet program may never terminate and the binding can't be interrupted.
+The jsonnet binding is an optional dependency (`pip install jsonnet`).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+
+from hub2labhook import metrics
+from hub2labhook.cache import SharedCache
+from hub2labhook.exception import InvalidParams, Unsupported
+
+logger = logging.getLogger(__name__)
+
+# sha256 of the sources -> JSON output of the evaluation
+COMPILED = SharedCache("ffci:jsonnet:compiled", ttl=7 * 86400, maxsize=256)
+
+# import "file.libsonnet", importstr 'file.txt', importbin "file.bin"
+IMPORT_RE = re.compile(r"""\b(import|importstr|importbin)\s*@?(["'])(.+?)(?<!\\)\2""")
+
+# Exit code of the child process when the binding isn't installed
+NO_BINDING = 3
+
+# Runs in a fresh interpreter: reads {"filename", "sources"} on stdin, writes
+# the output on stdout. Only the fetched sources can be imported.
+EVALUATE_SCRIPT = """
+import json, os, sys
+try:
+    import _jsonnet
+except ImportError:
+    sys.exit(%d)
+request = json.load(sys.stdin)
+sources = request["sources"]
+
+def import_callback(base, rel):
+    path = os.path.normpath(os.path.join(base, rel))
+    if path not in sources:
+        raise RuntimeError("file not found: %%s" %% path)
+    return path, sources[path].encode("utf-8", "surrogateescape")
+
+try:
+    output = _jsonnet.evaluate_snippet(
+        request["filename"],
+        sources[request["filename"]],
+        import_callback=import_callback,
+    )
+except RuntimeError as e:
+    sys.stderr.write(str(e))
+    sys.exit(1)
+sys.stdout.write(output)
+""" % NO_BINDING
+
+
+def import_paths(filename, content):
+    """Returns the [(kind, path)] imported by a source, relative to the repository"""
+    base = os.path.dirname(filename)
+    paths = []
+    for kind, _, rel in IMPORT_RE.findall(content):
+        path = os.path.normpath(os.path.join(base, rel))
+        if os.path.isabs(path) or path.startswith(".."):
+            # outside of the repository, the evaluation reports it
+            continue
+        paths.append((kind, path))
+    return paths
+
+
+def fetch_sources(filename, content, fetch, max_imports=100):
+    """
+    Collects a jsonnet file and everything it imports, recursively
+
+    Args:
+      filename (:obj:`str`) path of the file in the repository
+      content (:obj:`str`) its content
+      fetch (:obj:`callable`) path -> content, None if the file doesn't exist.
+                              The bytes of a binary file that aren't UTF-8 are
+                              decoded with the "surrogateescape" handler
+      max_imports (:obj:`int`) maximum number of imported files
+
+    Returns:
+      (:obj:`dict`) {path: content}
+    """
+    sources = {filename: content}
+    missing = set()
+    pending = [filename]
+    while pending:
+        current = pending.pop()
+        for kind, path in import_paths(current, sources[current]):
+            if path in sources or path in missing:
+                continue
+            if len(sources) > max_imports:
+                raise InvalidParams(
+                    "%s imports more than %s files" % (filename, max_imports)
+                )
+            imported = fetch(path)
+            if imported is None:
+                # can be a false positive (e.g. in a comment), a real missing
+                # import fails the evaluation
+                missing.add(path)
+                continue
+            sources[path] = imported
+            if kind == "import":
+                pending.append(path)
+    return sources
+
+
+def sources_digest(filename, sources):
+    digest = hashlib.sha256(filename.encode("utf-8"))
+    for path in sorted(sources):
+        digest.update(b"\0" + path.encode("utf-8"))
+        digest.update(b"\0" + sources[path].encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def evaluate(filename, sources, timeout=30):
+    """Evaluates `filename` in a child process, returns the output (JSON)"""
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", EVALUATE_SCRIPT],
+            input=json.dumps({"filename": filename, "sources": sources}),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise InvalidParams(
+            "%s: evaluation timed out after %ss" % (filename, timeout),
+            {"timeout": timeout},
+        )
+    if proc.returncode == NO_BINDING:
+        raise Unsupported("%s: the jsonnet module isn't installed" % filename)
+    if proc.returncode != 0:
+        raise InvalidParams(
+            "%s: evaluation failed" % filename, {"error": proc.stderr.strip()}
+        )
+    return proc.stdout
+
+
+def compile_ci_file(filename, content, fetch, timeout=30, max_imports=100):
+    """
+    Evaluates a jsonnet CI file, or returns the cached output of the same sources
+
+    Args:
+      filename (:obj:`str`) path of the file in the repository
+      content (:obj:`str`) its content
+      fetch (:obj:`callable`) path -> content of the imported files, None if
+                              the file doesn't exist
+      timeout (:obj:`int`) seconds the evaluation may take
+      max_imports (:obj:`int`) maximum number of imported files
+
+    Returns:
+      (:obj:`dict`) the GitLab CI document
+    """
+    sources = fetch_sources(filename, content, fetch, max_imports)
+    key = sources_digest(filename, sources)
+    output = COMPILED.get(key)
+    if output is not None:
+        metrics.incr("jsonnet_cache_hits")
+    else:
+        metrics.incr("jsonnet_cache_misses")
+        start = time.time()
+        output = evaluate(filename, sources, timeout)
+        logger.info(
+            "Evaluated %s (%s files) in %.2fs",
+            filename,
+            len(sources),
+            time.time() - start,
+        )
+        COMPILED.set(key, output)
+    document = json.loads(output)
+    if not isinstance(document, dict):
+        raise InvalidParams("%s must evaluate to an object" % filename)
+    return document
@@ -0,0 +1,89 @@
+"""
+Counters and gauges shared by the API and the workers.
+
+Counters are incremented in-process and in a Redis hash so that any process
+can report the totals (see /stats). Gauges are reported per worker process
+and expire with it. Without Redis, only the metrics of the current process
+are reported.
+"""
+
+import collections
+import os
+import socket
+import threading
+
+import redis
+
+from hub2labhook.cache import redis_client, redis_failed
+
+COUNTERS_KEY = "ffci:metrics:counters"
+GAUGES_KEY = "ffci:metrics:gauges:%s:%s"
+# A gauge not set again within that delay belongs to a dead process
+GAUGE_TTL = 3600
+
+_counters = collections.Counter()  # type: collections.Counter
+_counters_lock = threading.Lock()
+_gauges = {}  # type: dict
+
+
+def worker_id() -> str:
+    return "%s:%s" % (socket.gethostname(), os.getpid())
+
+
+def incr(name: str, value: int = 1) -> None:
+    with _counters_lock:
+        _counters[name] += value
+    client = redis_client()
+    if client is None:
+        return
+    try:
+        client.hincrby(COUNTERS_KEY, name, value)
+    except redis.exceptions.RedisError as exc:
+        redis_failed(exc)
+
+
+def counters() -> dict:
+    client = redis_client()
+    if client is not None:
+        try:
+            return {
+                k.decode(): int(v) for k, v in client.hgetall(COUNTERS_KEY).items()
+            }
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+    with _counters_lock:
+        return dict(_counters)
+
+
+def gauge(name: str, value: float) -> None:
+    """Sets the value of a gauge for the current process"""
+    _gauges[name] = value
+    client = redis_client()
+    if client is None:
+        return
+    try:
+        client.set(GAUGES_KEY % (name, worker_id()), value, ex=GAUGE_TTL)
+    except redis.exceptions.RedisError as exc:
+        redis_failed(exc)
+
+
+def gauges() -> dict:
+    """Returns the gauges of all the live processes: {name: {worker_id: value}}"""
+    client = redis_client()
+    if client is not None:
+        try:
+            keys = list(client.scan_iter(match=GAUGES_KEY % ("*", "*")))
+            res = collections.defaultdict(dict)  # type: dict
+            for key, value in zip(keys, client.mget(keys) if keys else []):
+                if value is None:
+                    continue
+                name, worker = key.decode().split(":", 3)[3].split(":", 1)
+                res[name][worker] = float(value)
+            return dict(res)
+        except redis.exceptions.RedisError as exc:
+            redis_failed(exc)
+    return {name: {worker_id(): value} for name, value in _gauges.items()}
+
+
+def snapshot() -> dict:
+    return {"counters": counters(), "gauges": gauges()}
@@ -1,97 +1,287 @@
+import collections
+import contextvars
+import threading
 import time
 import requests
 from datetime import datetime
 import uuid
-import tempfile
 import json
 import os
+import shutil
 import logging
 import yaml
-from io import StringIO
-
-from yaml.composer import ComposerError as YAMLComposeError
 
 from hub2labhook.github.client import GithubClient
 from hub2labhook.gitlab.client import GitlabClient
-from hub2labhook.exception import Unexpected, ResourceNotFound
+from hub2labhook.gitlab import ci_validator
+from hub2labhook.gitlab.ci_validator import GITLAB_CI_KEYS  # noqa: F401
+from hub2labhook.cache import SharedCache
+from hub2labhook.exception import (
+    InvalidParams,
+    Unexpected,
+    ResourceNotFound,
+    Unsupported,
+)
 from hub2labhook.utils import clone_url_with_auth
+from hub2labhook.gitcache import mirror_cache
+from hub2labhook.github import checkruns
+from hub2labhook import jsonnet
+from hub2labhook import metrics
+from hub2labhook.progress import ProgressReporter
+from hub2labhook.steps import StepGraph
+from hub2labhook.workspace import workspaces
 from hub2labhook.config import FFCONFIG
 
-from git import Repo
+from git import Repo, GitCommandError
 
 # from celery.contrib import rdb;rdb.set_trace()
 logger = logging.getLogger(__name__)
 
 DEFAULT_MODE = "sync"
 
-GITLAB_CI_KEYS = set(
-    [
-        "before_script",
-        "image",
-        "services",
-        "after_script",
-        "variables",
-        "stages",
-        "types",
-        "cache",
-    ]
+CLONE_STRATEGIES = ("full", "shallow", "partial")
+
+# "github repo:head sha" -> {"gitlab_url": str, "result": result of the sync}
+SYNCED_SHAS = SharedCache("ffci:pipeline:synced", ttl=7 * 86400, maxsize=2048)
+
+# A pipeline of the synced sha in one of these states is reused, not re-triggered
+REUSABLE_PIPELINE_STATUSES = (
+    "created",
+    "waiting_for_resource",
+    "preparing",
+    "pending",
+    "running",
+    "scheduled",
+    "success",
 )
 
 
+# GitHub rejects check-run outputs with a longer text
+CHECK_OUTPUT_LIMIT = 65535
+
+# The LogCapture of the current task, copied to the threads it starts
+_current_capture = contextvars.ContextVar("log_capture", default=None)
+
+
+class _CaptureHandler(logging.Handler):
+    """Root handler forwarding the records to the LogCapture of the current
+    task, records of other tasks (threads, greenlets) are neither formatted
+    nor captured"""
+
+    def filter(self, record):
+        return _current_capture.get() is not None
+
+    def emit(self, record):
+        capture = _current_capture.get()
+        if capture is not None:
+            capture.append(self.format(record))
+
+
+_capture_handler = _CaptureHandler(logging.DEBUG)
+_capture_handler.setFormatter(logging.Formatter("[%(levelname)s]  %(message)s"))
+
+
+def _install_capture_handler():
+    # celery resets the root handlers when it sets up the worker logging,
+    # after this module is imported: checked on each capture
+    root = logging.getLogger()
+    if _capture_handler not in root.handlers:
+        root.addHandler(_capture_handler)
+
+
+_install_capture_handler()
+
+
 class LogCapture:
-    def __init__(self):
-        self.log_capture_string = StringIO()
-        self.log_capture_handler = logging.StreamHandler(self.log_capture_string)
-        self.log_capture_handler.setLevel(logging.DEBUG)
-        self.log_capture_formatter = logging.Formatter("[%(levelname)s]  %(message)s")
-        self.log_capture_handler.setFormatter(self.log_capture_formatter)
-        self.root_logger = logging.getLogger()
-        self.root_logger.addHandler(self.log_capture_handler)
+    """Captures the logs of the current task, keeps the latest `max_chars`"""
+
+    def __init__(self, max_chars=CHECK_OUTPUT_LIMIT - 1024):
+        self.max_chars = max_chars
+        # room left for the truncation notice
+        self.budget = max_chars - 64
+        self.lines = collections.deque()  # type: collections.deque
+        self.size = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+        self._token = None
+
+    def append(self, line):
+        line = line[-(self.budget - 1):] + "\n"
+        with self._lock:
+            self.lines.append(line)
+            self.size += len(line)
+            while self.size > self.budget:
+                self.size -= len(self.lines.popleft())
+                self.truncated += 1
 
     def getvalue(self):
-        return self.log_capture_string.getvalue()
+        with self._lock:
+            text = "".join(self.lines)
+            if self.truncated:
+                text = "[...] %s earlier lines truncated\n%s" % (self.truncated, text)
+        return text
 
     def __enter__(self):
+        _install_capture_handler()
+        self._token = _current_capture.set(self)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.root_logger.removeHandler(self.log_capture_handler)
+        _current_capture.reset(self._token)
 
 
 class Pipeline(object):
-    def __init__(self, git_event, config=None):
+    def __init__(self, git_event, config=None, force=False):
+        """
+        Args:
+          git_event (:obj:`GithubEvent`) the event to build
+          config (:obj:`FailFastConfig`) configuration
+          force (:obj:`bool`) sync and trigger a new pipeline even if GitLab
+                              already runs one for the same sha
+        """
         if config is None:
             config = FFCONFIG
         self.ghevent = git_event
         self.config = config
+        self.force = force
         self.github = GithubClient(installation_id=self.ghevent.installation_id)
         self.check_run = None
 
     def _parse_ci_file(self, content, filepath):
         if filepath == ".gitlab-ci.yml":
             return yaml.safe_load(content)
+        elif filepath == ".failfast-ci.jsonnet":
+            conf = self.config.failfast["jsonnet"]
+            return jsonnet.compile_ci_file(
+                filepath,
+                content,
+                self._fetch_source,
+                timeout=conf["timeout"],
+                max_imports=conf["max_imports"],
+            )
 
-    def _checkout_repo(self, gevent, repo_path):
+    def _fetch_source(self, path):
+        """Content of a file at `head_sha`, None if it doesn't exist"""
+        try:
+            content = self.github.fetch_file(
+                self.ghevent.repo, path, ref=self.ghevent.head_sha
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        if isinstance(content, bytes):
+            # keeps the bytes of the files imported with importbin
+            content = content.decode("utf-8", "surrogateescape")
+        return content
+
+    def _commit_gitlab_ci(self, gitbin, repo_path, gitlab_ci, source):
+        """Commits the .gitlab-ci.yml generated from `source` on top of the built sha.
+        The commit dates are the ones of the built commit so that syncing the
+        same sha again produces the same commit"""
+        with open(os.path.join(repo_path, ".gitlab-ci.yml"), "w") as f:
+            f.write(gitlab_ci)
+        gitbin.add(".gitlab-ci.yml")
+        date = gitbin.log("-1", "--format=%cI")
+        gitbin.commit(
+            "-m",
+            checkruns.generated_commit_message(source, self.ghevent.head_sha),
+            env={"GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date},
+        )
+        ci_sha = str(gitbin.rev_parse("HEAD"))
+        checkruns.map_ci_sha(ci_sha, self.ghevent.head_sha)
+        logger.info("Committed the generated .gitlab-ci.yml: %s", ci_sha)
+        return ci_sha
+
+    def clone_options(self, ci_variables=None):
+        """How to clone the repository: `failfast.clone` settings, overridden per
+        repository in `failfast.clone.repos` then by the CI file variables
+        FAILFAST_CLONE_STRATEGY, FAILFAST_CLONE_DEPTH and FAILFAST_CLONE_SKIP_LFS"""
+        conf = self.config.failfast["clone"]
+        options = {
+            "strategy": conf["strategy"],
+            "depth": conf["depth"],
+            "skip_lfs": conf["skip_lfs"],
+        }
+        options.update(conf.get("repos", {}).get(self.ghevent.repo, {}))
+        if ci_variables:
+            for key in ["strategy", "depth", "skip_lfs"]:
+                var = "FAILFAST_CLONE_%s" % key.upper()
+                if var in ci_variables:
+                    options[key] = ci_variables[var]
+        options["depth"] = int(options["depth"])
+        options["skip_lfs"] = str(options["skip_lfs"]).lower() in ("1", "true")
+        if options["strategy"] not in CLONE_STRATEGIES:
+            raise InvalidParams(
+                "Unknown clone strategy: %s" % options["strategy"],
+                {"strategies": list(CLONE_STRATEGIES)},
+            )
+        return options
+
+    def _clone(self, gevent, clone_url, repo_path, options):
+        env = {}
+        if options["skip_lfs"]:
+            env = {"GIT_LFS_SKIP_SMUDGE": "1", "GIT_LFS_SKIP_PUSH": "1"}
+        if options["strategy"] == "shallow":
+            # Only the ref to build is fetched, by _checkout_repo
+            repo = Repo.init(repo_path)
+            repo.git.remote("add", "origin", clone_url)
+        elif options["strategy"] == "partial":
+            repo = Repo.clone_from(clone_url, repo_path, env=env, filter="blob:none")
+        elif mirror_cache(self.config) is not None:
+            refspecs = ["+refs/heads/*:refs/heads/*"]
+            if gevent.pr_id != "":
+                refspecs.append(
+                    "+refs/pull/%s/head:refs/pull/%s/head"
+                    % (gevent.pr_id, gevent.pr_id)
+                )
+            repo = mirror_cache(self.config).clone(
+                gevent.repo, clone_url, repo_path, refspecs, env=env
+            )
+        else:
+            repo = Repo.clone_from(clone_url, repo_path, env=env)
+        repo.git.update_environment(**env)
+        return repo
+
+    def _checkout_repo(self, gevent, repo_path, ci_variables=None):
+        options = self.clone_options(ci_variables)
+        logger.info("Clone options: %s", options)
         clone_url = clone_url_with_auth(gevent.clone_url, "bot:%s" % self.github.token)
         try_count = 0
         while try_count < 3:
             try:
-                time.sleep(1)
-                gitbin = Repo.clone_from(clone_url, repo_path).git
+                gitbin = self._clone(gevent, clone_url, repo_path, options).git
                 break
             except Exception:
                 try_count = try_count + 1
                 if try_count >= 3:
                     raise
+                shutil.rmtree(repo_path, ignore_errors=True)
+                time.sleep(try_count)
 
         gitbin.config("http.postBuffer", "1524288000")
         gitbin.config("--local", "user.name", "FailFast-ci Bot")
         gitbin.config("--local", "user.email", "failfastci-bot@failfast-ci.io")
+        depth = []
+        if options["strategy"] == "shallow":
+            depth = ["--depth", str(options["depth"])]
         if gevent.pr_id == "":
-            gitbin.checkout(gevent.refname)
+            if depth:
+                # not into refs/heads/<branch>: the fresh repository has it
+                # checked out (unborn) when it's the default branch
+                gitbin.fetch(
+                    *depth,
+                    "origin",
+                    "+%s:refs/remotes/origin/%s" % (gevent.ref, gevent.refname),
+                )
+                gitbin.checkout("-B", gevent.refname, "FETCH_HEAD")
+            else:
+                gitbin.checkout(gevent.refname)
         else:
             pr_branch = "pr-%s" % gevent.pr_id
-            gitbin.fetch("origin", "pull/%s/head:%s" % (gevent.pr_id, pr_branch))
+            gitbin.fetch(
+                *depth, "origin", "pull/%s/head:%s" % (gevent.pr_id, pr_branch)
+            )
             gitbin.checkout(pr_branch)
         if not gitbin.rev_parse("HEAD") == gevent.head_sha:
             logger.error(
@@ -105,19 +295,27 @@ class Pipeline(object):
             )
         return gitbin
 
-    def _get_ci_file(self, repo_path):
-        content = None
-        for filepath in [".gitlab-ci.yml", ".failfast-ci.jsonnet"]:
-            path = os.path.join(repo_path, filepath)
-            if not os.path.exists(path):
-                continue
-            with open(path, "r") as f:
-                content = f.read()
-                return {"content": content, "file": filepath}
-        if content is None:
-            log = "no .gitlab-ci.yml or .failfast-ci.jsonnet"
-            logger.error(log)
-            raise ResourceNotFound(log)
+    def _push(self, gitbin, *args):
+        try:
+            return gitbin.push(*args)
+        except GitCommandError as e:
+            if "shallow" not in str(e):
+                raise
+            # GitLab refuses shallow pushes when it doesn't have the history
+            logger.info("Shallow push refused, fetching the full history")
+            gitbin.fetch("--unshallow", "origin")
+            return gitbin.push(*args)
+
+    def _fetch_ci_file(self, gevent):
+        """Fetches the CI file of `head_sha` with the contents API"""
+        try:
+            ci_file = self.github.get_ci_file(gevent.repo, gevent.head_sha)
+        except ResourceNotFound:
+            logger.error("no .gitlab-ci.yml or .failfast-ci.jsonnet")
+            raise
+        if isinstance(ci_file["content"], bytes):
+            ci_file["content"] = ci_file["content"].decode("utf-8")
+        return ci_file
 
     def create_sync_check_run(self, gevent):
         eid = {
@@ -179,10 +377,67 @@ class Pipeline(object):
             body["conclusion"] = conclusion
         return body
 
+    @property
+    def synced_key(self):
+        """A sync is reused for the same sha pushed to the same GitLab ref, with
+        the same event variables (EVENT, PR_LABELS) in its pipeline"""
+        gevent = self.ghevent
+        return "%s:%s@%s:%s:%s" % (
+            gevent.repo,
+            gevent.target_refname,
+            gevent.head_sha,
+            gevent.event_type,
+            ",".join(sorted(gevent.labels)),
+        )
+
+    def find_synced_pipeline(self):
+        """
+        Returns the result of a previous sync of the same sha if GitLab still
+        has it: the target ref points at the pushed commit and its latest
+        pipeline is running or succeeded. Costs a branch and a pipelines lookup
+        instead of a clone, a push and a new pipeline.
+        """
+        synced = SYNCED_SHAS.get(self.synced_key)
+        if synced is None:
+            return None
+        result = synced["result"]
+        if result["ci_ref"] != self.ghevent.target_refname:
+            return None
+        gitlab = GitlabClient(synced["gitlab_url"], config=self.config)
+        try:
+            branch = gitlab.get_branch(result["ci_project_id"], result["ci_ref"])
+            if branch is None or branch["commit"]["id"] != result["ci_sha"]:
+                return None
+            pipelines = gitlab.get_pipelines(
+                result["ci_project_id"], ref=result["ci_ref"], sha=result["ci_sha"]
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not look up the synced pipeline: %s", e)
+            return None
+        if not pipelines or pipelines[0]["status"] not in REUSABLE_PIPELINE_STATUSES:
+            return None
+        logger.info(
+            "%s already synced, reusing pipeline %s (%s)",
+            self.synced_key,
+            pipelines[0]["id"],
+            pipelines[0]["status"],
+        )
+        metrics.incr("pipeline_syncs_reused")
+        return dict(result, pipeline_id=pipelines[0]["id"])
+
+    @property
+    def workspace_key(self):
+        return "%s-%s" % (self.ghevent.repo, self.ghevent.head_sha[0:12])
+
     def trigger_pipeline(self):
-        with LogCapture() as logs:
+        if not self.force:
+            synced = self.find_synced_pipeline()
+            if synced is not None:
+                return synced
+        workspace = workspaces(self.config).workspace(self.workspace_key)
+        with LogCapture() as logs, workspace as dirpath:
             try:
-                return self._trigger_pipeline(logs)
+                return self._trigger_pipeline(logs, dirpath)
             except Exception as e:
                 logger.error("Error: %s", e)
                 if self.check_run is not None:
@@ -223,87 +478,62 @@ class Pipeline(object):
                     logger.error("Could not cancel check: %s", e)
                     pass
 
-    def _trigger_pipeline(self, logs):
-        gevent = self.ghevent
-        gitlab_user = self.config.gitlab["robot-user"]
-        dirpath = tempfile.mkdtemp()
-        repo_path = os.path.join(str(dirpath), "repo")
-
-        check_run = self.github.create_check(
-            gevent.repo, self.create_sync_check_run(gevent)
-        )
-        self.check_run = check_run
-
-        logger.info("Cancelling previous checks...")
-
-        self.neutralize_previous_checks()
+    def _report_progress(self, logs):
         self.github.update_check_run(
-            gevent.repo,
+            self.ghevent.repo,
             self.update_sync_check_run(
-                check_run, "in_progress", "in_progress", logs.getvalue()
+                self.check_run, "in_progress", "in_progress", logs.getvalue()
             ),
-            check_run["id"],
+            self.check_run["id"],
         )
 
-        logger.info("Cloning repo %s", repo_path)
-        gitbin = self._checkout_repo(gevent, repo_path)
-        logger.info("...Cloned repo %s", repo_path)
-        self.github.update_check_run(
-            gevent.repo,
-            self.update_sync_check_run(
-                check_run, "in_progress", "in_progress", logs.getvalue()
-            ),
-            check_run["id"],
-        )
-
-        # 1 Create new TestSuit
-
+    def _read_ci_file(self, gevent):
+        # The CI file is checked before cloning: a repository without or with
+        # an invalid CI file must not cost a clone
         try:
-            ci_file = self._get_ci_file(repo_path)
+            ci_file = self._fetch_ci_file(gevent)
         except ResourceNotFound:
-            self.github.update_check_run(
-                gevent.repo,
-                self.update_sync_check_run(
-                    check_run, "completed", "failure", logs.getvalue()
-                ),
-                self.check_run["id"],
+            raise Unexpected(
+                "Could not find a CI config file in: %s@%s"
+                % (gevent.repo, gevent.head_sha)
             )
-            raise Unexpected("Could not find a CI config file in: %s" % (repo_path))
 
         try:
             content = self._parse_ci_file(ci_file["content"], ci_file["file"])
-        except YAMLComposeError:
-            logger.error("Could not parse CI file: %s", ci_file["file"])
-            self.github.update_check_run(
-                gevent.repo,
-                self.update_sync_check_run(
-                    check_run, "completed", "failure", logs.getvalue()
-                ),
-                check_run["id"],
+        except (yaml.YAMLError, InvalidParams, Unsupported) as e:
+            logger.error(
+                "Could not parse CI file %s: %s %s",
+                ci_file["file"],
+                e,
+                getattr(e, "payload", ""),
             )
             raise Unexpected("Could not parse CI file: %s" % (ci_file["file"]), {})
 
-        if self.config.failfast["enable_linter"]:
-            lint_resp = GitlabClient().gitlabci_lint(ci_file["content"])
-            if "status" not in lint_resp or lint_resp["status"] != "valid":
-                logger.error("Invalid .gitlab-ci.yml syntax: %s", lint_resp)
-                self.github.update_check_run(
-                    gevent.repo,
-                    self.update_sync_check_run(
-                        check_run, "completed", "failure", logs.getvalue()
-                    ),
-                    check_run["id"],
-                )
-
-                raise Unexpected(".gitlab-ci.yml syntax error", {"r": lint_resp})
-
-        variables = content.get("variables", dict())
-
+        ci_file["gitlab_ci"] = ci_file["content"]
+        if ci_file["file"] != ".gitlab-ci.yml":
+            ci_file["gitlab_ci"] = yaml.safe_dump(content, default_flow_style=False)
+        ci_file["parsed"] = content
+        return ci_file
+
+    def _validate_ci_file(self, ci_file):
+        # Obvious errors are reported without calling GitLab
+        errors = ci_validator.validate(ci_file["parsed"])
+        if errors:
+            logger.error("Invalid .gitlab-ci.yml:\n  %s", "\n  ".join(errors))
+            raise Unexpected(".gitlab-ci.yml syntax error", {"errors": errors})
+
+    def _lint_ci_file(self, ci_file):
+        lint_resp = GitlabClient().gitlabci_lint(ci_file["gitlab_ci"])
+        if "status" not in lint_resp or lint_resp["status"] != "valid":
+            logger.error("Invalid .gitlab-ci.yml syntax: %s", lint_resp)
+            raise Unexpected(".gitlab-ci.yml syntax error", {"r": lint_resp})
+
+    def _initialize_project(self, variables):
         namespace = variables.get(
             "FAILFASTCI_NAMESPACE", self.config.gitlab.get("namespace", None)
         )
         repo = variables.get("GITLAB_REPOSITORY", None)
-        reponame = gevent.repo.replace("/", "_")
+        reponame = self.ghevent.repo.replace("/", "_")
         if repo:
             namespace, reponame = repo.split("/")
         gitlab_endpoint = variables.get(
@@ -315,14 +545,22 @@ class Pipeline(object):
         logger.info(
             "Initialized project: %s, %s/%s", ci_project["id"], namespace, reponame
         )
-        self.github.update_check_run(
-            gevent.repo,
-            self.update_sync_check_run(
-                check_run, "in_progress", "in_progress", logs.getvalue()
-            ),
-            check_run["id"],
+        return ci_project
+
+    def _clone_step(self, gevent, repo_path, ci_file):
+        logger.info("Cloning repo %s", repo_path)
+        gitbin = self._checkout_repo(
+            gevent, repo_path, ci_file["parsed"].get("variables", dict())
         )
+        logger.info("...Cloned repo %s", repo_path)
+        if ci_file["file"] != ".gitlab-ci.yml":
+            self._commit_gitlab_ci(
+                gitbin, repo_path, ci_file["gitlab_ci"], ci_file["file"]
+            )
+        return gitbin
 
+    def _push_step(self, gevent, gitbin, ci_project):
+        gitlab_user = self.config.gitlab["robot-user"]
         # @Todo(ant31) check if clone_url is required
         # clone_url = clone_url_with_auth(gevent.clone_url, "bot:%s" % self.github.token)
         target_url = clone_url_with_auth(
@@ -330,9 +568,13 @@ class Pipeline(object):
             "%s:%s" % (gitlab_user, self.gitlab.gitlab_token),
         )
         gitbin.remote("add", "target", target_url)
-        labels = ",".join(gevent.labels)
-        variables = {
-            "PR_LABELS": labels,
+        options = ["-o", f"ci.skip"]
+        self._push(gitbin, "target", "HEAD:%s" % gevent.target_refname, "-f", *options)
+        logger.info("Pushed to gitlab: %s", gevent.target_refname)
+
+    def pipeline_variables(self, gevent):
+        return {
+            "PR_LABELS": ",".join(gevent.labels),
             "EVENT": gevent.event_type,
             "PR_ID": str(gevent.pr_id),
             "SHA": gevent.head_sha,
@@ -346,45 +588,113 @@ class Pipeline(object):
             "GITHUB_REPO": gevent.repo,
         }
 
-        content["variables"] = variables
+    def _trigger_pipeline(self, logs, dirpath):
+        """
+        Syncs the sha to GitLab and triggers its pipeline. The steps run on a
+        StepGraph: independent steps (previous checks, CI file, GitLab project,
+        remote lint, clone) run concurrently. A failing step fails the sync
+        check-run, reported by `trigger_pipeline`.
+        """
+        gevent = self.ghevent
+        repo_path = os.path.join(str(dirpath), "repo")
+        full_sync = DEFAULT_MODE == "sync"
 
-        self.gitlab.set_variables(
-            ci_project["id"],
-            {
-                "GITHUB_INSTALLATION_ID": str(gevent.installation_id),
-                "GITHUB_REPO": gevent.repo,
-            },
-        )
-        logger.info("Setting variables: %s", variables)
-        self.github.update_check_run(
-            gevent.repo,
-            self.update_sync_check_run(
-                check_run, "in_progress", "in_progress", logs.getvalue()
-            ),
-            check_run["id"],
+        def report_progress():
+            if self.check_run is not None:
+                self._report_progress(logs)
+
+        reporter = ProgressReporter(
+            report_progress, self.config.failfast["progress_interval"]
         )
+        graph = StepGraph(max_workers=4, on_step_done=lambda name: reporter.update())
+        results = graph.results
 
-        perform_sync = variables.get("FAILFAST_SYNC_REPO", "false")
+        def create_check():
+            self.check_run = self.github.create_check(
+                gevent.repo, self.create_sync_check_run(gevent)
+            )
 
-        if (perform_sync == "true") or (DEFAULT_MODE == "sync"):
-            # Full synchronize the repo)
-            options = ["-o", f"ci.skip"]
-            gitbin.push("target", "HEAD:%s" % gevent.target_refname, "-f", *options)
-            logger.info("Pushed to gitlab: %s", gevent.target_refname)
-            pipeline = self.gitlab.new_pipeline(
-                ci_project["id"], ref=gevent.target_refname, variables=variables
+        def neutralize():
+            logger.info("Cancelling previous checks...")
+            self.neutralize_previous_checks()
+
+        graph.add("check", create_check)
+        graph.add("neutralize", neutralize)
+        graph.add("ci_file", lambda: self._read_ci_file(gevent))
+        after_validation = ["ci_file"]
+        if self.config.failfast["enable_linter"]:
+            graph.add(
+                "validate",
+                lambda: self._validate_ci_file(results["ci_file"]),
+                after=["ci_file"],
+            )
+            # The remote lint runs while cloning
+            graph.add(
+                "lint",
+                lambda: self._lint_ci_file(results["ci_file"]),
+                after=["validate"],
             )
+            after_validation = ["validate"]
+        graph.add(
+            "project",
+            lambda: self._initialize_project(
+                results["ci_file"]["parsed"].get("variables", dict())
+            ),
+            after=["ci_file"],
+        )
+        graph.add(
+            "github_target",
+            lambda: self.gitlab.set_github_target(
+                results["project"]["id"], gevent.installation_id, gevent.repo
+            ),
+            after=["project"],
+        )
+        if full_sync:
+            graph.add(
+                "clone",
+                lambda: self._clone_step(gevent, repo_path, results["ci_file"]),
+                after=after_validation,
+            )
+            graph.add(
+                "push",
+                lambda: self._push_step(gevent, results["clone"], results["project"]),
+                after=["clone", "project"]
+                + (["lint"] if "lint" in graph.steps else []),
+            )
+            graph.add(
+                "pipeline",
+                lambda: self.gitlab.new_pipeline(
+                    results["project"]["id"],
+                    ref=gevent.target_refname,
+                    variables=self.pipeline_variables(gevent),
+                ),
+                after=["check", "push", "github_target"],
+            )
+        try:
+            with reporter:
+                graph.run()
+        finally:
+            logger.info("Steps: %s", graph.format_timings())
+
+        ci_file, ci_project = results["ci_file"], results["project"]
+        variables = self.pipeline_variables(gevent)
+        content = ci_file["parsed"]
+        content["variables"] = variables
+        logger.info("Setting variables: %s", variables)
+
+        if full_sync:
+            pipeline = results["pipeline"]
             logger.info("Pipeline triggered: %s", pipeline["id"])
             self.github.update_check_run(
                 gevent.repo,
                 self.update_sync_check_run(
-                    check_run, "completed", "success", logs.getvalue()
+                    self.check_run, "completed", "success", logs.getvalue()
                 ),
-                check_run["id"],
+                self.check_run["id"],
             )
 
-            ci_sha = str(gitbin.rev_parse("HEAD"))
-            return {  # NOTE: the GitHub reference details for subsequent tasks.
+            ci_sha = str(results["clone"].rev_parse("HEAD"))
+            result = {  # NOTE: the GitHub reference details for subsequent tasks.
                 "sha": gevent.head_sha,
                 "ci_sha": ci_sha,
                 "ref": gevent.refname,
@@ -393,9 +703,13 @@ class Pipeline(object):
                 "pipeline_id": pipeline["id"],
                 "installation_id": gevent.installation_id,
                 "github_repo": gevent.repo,
-                "labels": labels,
+                "labels": variables["PR_LABELS"],
                 "context": self.config.github["context"],
             }
+            SYNCED_SHAS.set(
+                self.synced_key, {"gitlab_url": self.gitlab.endpoint, "result": result}
+            )
+            return result
         else:
             self.sync_only_ci_file(gevent, content, ci_project, ci_file)
 
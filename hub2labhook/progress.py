@@ -0,0 +1,70 @@
+"""
+Throttled reporting of the progress of a build.
+
+The build signals progress with `update()`, which never blocks. A background
+thread calls `flush` at most every `interval` seconds, so the build neither
+waits on GitHub nor spends an API call per step. Updates signaled after the
+last flush are dropped by `stop()`: the caller sends the final state itself.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporter(object):
+    def __init__(self, flush, interval: float = 5.0) -> None:
+        """
+        Args:
+          flush (:obj:`callable`) sends the current progress
+          interval (:obj:`float`) minimum seconds between two flushes
+        """
+        self.flush = flush
+        self.interval = interval
+        self.flushes = 0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> "ProgressReporter":
+        self._thread = threading.Thread(
+            target=self._run, name="progress-reporter", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def update(self) -> None:
+        """Signals new progress, flushed by the background thread"""
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stops the reporter, waits for a flush in progress"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        last = 0.0
+        while True:
+            self._wake.wait()
+            if self._stopped.is_set():
+                return
+            delay = last + self.interval - time.time()
+            if delay > 0 and self._stopped.wait(delay):
+                return
+            self._wake.clear()
+            try:
+                self.flush()
+                self.flushes += 1
+            except Exception as e:
+                logger.warning("Could not report progress: %s", e)
+            last = time.time()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,86 @@
+"""
+Execution of a graph of dependent steps on a thread pool.
+
+Each step starts as soon as the steps it depends on succeeded, independent
+steps run concurrently. The first failure stops the scheduling of new steps,
+waits for the running ones, then is raised to the caller unchanged.
+"""
+
+import contextvars
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class StepGraph(object):
+    def __init__(self, max_workers: int = 4, on_step_done=None) -> None:
+        """
+        Args:
+          max_workers (:obj:`int`) number of steps running at the same time
+          on_step_done (:obj:`callable`) called with the step name after each
+                                         successful step, in the calling thread
+        """
+        self.max_workers = max_workers
+        self.on_step_done = on_step_done
+        self.steps = OrderedDict()  # type: OrderedDict
+        self.results = {}  # type: dict
+        self.timings = OrderedDict()  # type: OrderedDict
+
+    def add(self, name: str, func, after=()) -> None:
+        """Adds the step `name` running `func()` once the steps `after` succeeded.
+        The return value of func is stored in `results[name]`"""
+        for dep in after:
+            if dep not in self.steps:
+                raise ValueError("%s: unknown step %s" % (name, dep))
+        self.steps[name] = (func, tuple(after))
+
+    def _run_step(self, name, func):
+        start = time.time()
+        try:
+            return func()
+        finally:
+            self.timings[name] = time.time() - start
+
+    def run(self) -> dict:
+        pending = OrderedDict(self.steps)
+        running = {}
+        done = set()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, (func, after) in list(pending.items()):
+                        if all(dep in done for dep in after):
+                            del pending[name]
+                            # the step inherits the context (e.g. the log capture)
+                            future = executor.submit(
+                                contextvars.copy_context().run,
+                                self._run_step,
+                                name,
+                                func,
+                            )
+                            running[future] = name
+                if not running:
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        logger.debug("Step %s failed: %s", name, e)
+                        if error is None:
+                            error = e
+                        continue
+                    done.add(name)
+                    if self.on_step_done is not None and error is None:
+                        self.on_step_done(name)
+        if error is not None:
+            raise error
+        return self.results
+
+    def format_timings(self) -> str:
+        return ", ".join("%s=%.2fs" % (k, v) for k, v in self.timings.items())
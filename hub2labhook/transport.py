@@ -0,0 +1,74 @@
+"""
+Pooled keep-alive HTTP sessions for the GitHub and GitLab clients.
+
+A `requests.Session` is kept per host and per process so that API calls reuse
+the TCP/TLS connections. Sessions are dropped when the process id changes
+(gunicorn `preload_app`, celery prefork) so children never share a socket
+with their parent.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hub2labhook.config import FFCONFIG
+
+
+class TimeoutSession(requests.Session):
+    """A session applying a default timeout to requests which don't set one"""
+
+    def __init__(self, timeout=None):
+        super(TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout", None) is None:
+            kwargs["timeout"] = self.timeout
+        return super(TimeoutSession, self).request(method, url, **kwargs)
+
+
+_sessions = {}  # type: dict
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def _new_session(timeout):
+    pool_size = FFCONFIG.failfast["http_pool_size"]
+    sess = TimeoutSession(timeout=timeout)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+
+def session(url: str, timeout: float = None) -> requests.Session:
+    """Returns the session of the current process for the host of `url`
+
+    Args:
+      url (:obj:`str`) any url of the host
+      timeout (:obj:`float`) default timeout of the requests sent with the session
+    """
+    global _sessions_pid
+    host = urlsplit(url)[0:2]
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # Forked: the parent's connections are not ours to use
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        if host not in _sessions:
+            _sessions[host] = _new_session(timeout)
+        return _sessions[host]
+
+
+def reset_sessions(*args, **kwargs):
+    """Closes all the sessions of the process, connected to worker/fork signals"""
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid == os.getpid():
+            for sess in _sessions.values():
+                sess.close()
+        _sessions.clear()
+        _sessions_pid = os.getpid()
@@ -0,0 +1,194 @@
+"""
+Build directories of the sync pipelines.
+
+A `WorkspaceManager` owns the directories the repositories are cloned into:
+a build allocates one for its lifetime and the directory is removed in the
+background once the build is over, whether it succeeded or failed. A retry
+of the same build reuses (after wiping) the directory left by a dead worker.
+Directories in use are flocked so that the quota enforcement, which evicts
+the least recently used directories, never removes a live one, even one of
+another worker process. The quota counts the idle directories (being
+removed, or left by a dead worker): their size is stored next to them when
+they are released or first found, live checkouts are never walked.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from hub2labhook import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def disk_usage(path: str) -> int:
+    """Size in bytes of a directory tree, symlinks not followed"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager(object):
+    def __init__(self, root: str, quota: int) -> None:
+        """
+        Args:
+          root (:obj:`str`) directory of the workspaces
+          quota (:obj:`int`) disk usage in bytes above which the least recently
+                             used idle workspaces are evicted
+        """
+        self.root = root
+        self.quota = quota
+        os.makedirs(self.root, exist_ok=True)
+        self._live = {}  # type: dict
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    @property
+    def executor(self):
+        """Single background thread running the cleanups, recreated after a fork"""
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _try_lock(self, path):
+        lockfile = open(path + ".lock", "a")
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # removed by an eviction meanwhile: the directory went with it
+            current = os.stat(path + ".lock")
+            if not os.path.samestat(current, os.fstat(lockfile.fileno())):
+                raise BlockingIOError()
+        except (BlockingIOError, FileNotFoundError):
+            lockfile.close()
+            return None
+        return lockfile
+
+    def usage(self, path: str) -> int:
+        """Size of an idle directory, measured once"""
+        try:
+            with open(path + ".size") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return self._measure(path)
+
+    def _measure(self, path: str) -> int:
+        size = disk_usage(path)
+        with open(path + ".size", "w") as f:
+            f.write(str(size))
+        return size
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path):
+            # partly removed: measured again
+            with contextlib.suppress(OSError):
+                os.remove(path + ".size")
+            return
+        for extra in (".size", ".lock"):
+            with contextlib.suppress(OSError):
+                os.remove(path + extra)
+
+    def allocate(self, key: str) -> str:
+        """Returns an empty directory for the build `key`, locked until released"""
+        self.enforce_quota()
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        path = os.path.join(self.root, name)
+        lockfile = self._try_lock(path)
+        if lockfile is None:
+            # the same build is running concurrently: don't share its directory
+            path = os.path.join(self.root, "%s-%s" % (name, uuid.uuid4().hex[0:8]))
+            lockfile = self._try_lock(path)
+        if os.path.exists(path):
+            logger.info("Reusing workspace left by a previous attempt: %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+        with contextlib.suppress(OSError):
+            os.remove(path + ".size")
+        os.makedirs(path)
+        with self._lock:
+            self._live[path] = lockfile
+            metrics.gauge("workspace_dirs_live", len(self._live))
+        return path
+
+    def release(self, path: str) -> None:
+        """Removes the directory in the background then enforces the quota"""
+        with self._lock:
+            lockfile = self._live.pop(path, None)
+            metrics.gauge("workspace_dirs_live", len(self._live))
+        self.executor.submit(self._cleanup, path, lockfile)
+
+    def _cleanup(self, path, lockfile):
+        try:
+            # counted by the quota enforcement if the removal fails
+            self._measure(path)
+            self._remove(path)
+            if lockfile is not None:
+                lockfile.close()
+            self.enforce_quota()
+        except Exception as e:
+            logger.error("Workspace cleanup failed %s: %s", path, e)
+
+    def enforce_quota(self) -> int:
+        """Evicts the least recently used idle directories above the quota,
+        returns the bytes used by the idle directories"""
+        idle = []
+        try:
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isdir(path):
+                    continue
+                with self._lock:
+                    if path in self._live:
+                        continue
+                lockfile = self._try_lock(path)
+                if lockfile is None:
+                    # live in another worker process
+                    continue
+                idle.append((os.path.getmtime(path), path, lockfile))
+            sizes = {path: self.usage(path) for _, path, _ in idle}
+            total = sum(sizes.values())
+            for _, path, _ in sorted(idle, key=lambda entry: entry[0:2]):
+                if total <= self.quota:
+                    break
+                self._remove(path)
+                total -= sizes[path]
+                metrics.incr("workspace_evictions")
+                logger.info("Evicted workspace %s", path)
+        finally:
+            for _, _, lockfile in idle:
+                lockfile.close()
+        metrics.gauge("workspace_bytes_used", total)
+        return total
+
+    @contextlib.contextmanager
+    def workspace(self, key: str):
+        path = self.allocate(key)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+
+_managers = {}  # type: dict
+_managers_lock = threading.Lock()
+
+
+def workspaces(config) -> WorkspaceManager:
+    """Returns the WorkspaceManager of `failfast.workspace_dir`, shared by the process"""
+    root = config.failfast["workspace_dir"]
+    with _managers_lock:
+        if root not in _managers:
+            _managers[root] = WorkspaceManager(root, config.failfast["workspace_quota"])
+        return _managers[root]
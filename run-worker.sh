@@ -6,9 +6,20 @@ GITHUB_CONTEXT=${GITHUB_CONTEXT:-gitlab-ci}
 GITLAB_TOKEN=${GITLAB_TOKEN:-mytoken}
 GITLAB_USER=${GITLAB_USER:-myusername}
 GITLAB_REPO=${GITLAB_REPO:-ant31/hub2lab}
+# Queues consumed, in priority order: sync, status, admin (see celeryconfig.py)
+#   QUEUES=sync CONCURRENCY=2 PREFETCH=1 ./run-worker.sh
+#   QUEUES=admin,status CONCURRENCY=8 ./run-worker.sh
+QUEUES=${QUEUES:-admin,status,sync,celery}
+PREFETCH=${PREFETCH:-4}
+
+CONCURRENCY_OPT=""
+if [ -n "$CONCURRENCY" ]; then
+    CONCURRENCY_OPT="--concurrency $CONCURRENCY"
+fi
 
 CELERY_BROKER_URL=$CELERY_BROKER \
            GITLAB_REPO=$GITLAB_REPO \
            GITHUB_CONTEXT=$GITHUB_CONTEXT \
            GITLAB_TOKEN=$GITLAB_TOKEN \
-           celery -A hub2labhook.jobs.runner worker -l debug
+           celery -A hub2labhook.jobs.runner worker -l debug \
+           -Q $QUEUES --prefetch-multiplier $PREFETCH $CONCURRENCY_OPT
@@ -0,0 +1,74 @@
+"""
+Compile cost of a generated .failfast-ci.jsonnet, cold and cached.
+
+    python scripts/bench_jsonnet.py [jobs] [libraries]
+
+Generates a pipeline of `jobs` jobs spread across `libraries` imported files
+and measures the import collection, a cold evaluation (child process) and a
+cached compilation.
+"""
+import sys
+import time
+
+from hub2labhook import jsonnet
+from hub2labhook.config import FFCONFIG
+
+LIBRARY = """
+local base = import "base.libsonnet";
+{
+  jobs(prefix, n):: {
+    [prefix + "-" + i]: base.job("test", ["make test-" + prefix + "-" + i])
+    for i in std.range(0, n - 1)
+  },
+}
+"""
+
+BASE = """
+{
+  job(stage, script):: {
+    stage: stage,
+    image: "python:3.8",
+    script: script,
+    variables: {FAILFAST: "1"},
+    tags: ["failfast-ci"],
+  },
+}
+"""
+
+
+def generate(jobs, libraries):
+    files = {"ci/base.libsonnet": BASE}
+    imports = []
+    for i in range(libraries):
+        files["ci/lib%s.libsonnet" % i] = LIBRARY
+        imports.append(
+            '(import "ci/lib%s.libsonnet").jobs("lib%s", %s)'
+            % (i, i, jobs // libraries)
+        )
+    main = '{stages: ["test"]} + %s' % " + ".join(imports)
+    return main, files
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    print("%-20s %8.3fs" % (label, time.time() - start))
+    return result
+
+
+def main(jobs=2000, libraries=20):
+    FFCONFIG.failfast["redis_url"] = None
+    main, files = generate(jobs, libraries)
+    filename = ".failfast-ci.jsonnet"
+    print("%s jobs, %s imported files" % (jobs, libraries + 1))
+    sources = timed("collect imports", jsonnet.fetch_sources, filename, main, files.get)
+    timed("digest", jsonnet.sources_digest, filename, sources)
+    output = timed("evaluate (cold)", jsonnet.evaluate, filename, sources)
+    print("%-20s %8.1fKiB" % ("output", len(output) / 1024.0))
+    jsonnet.COMPILED.local.clear()
+    timed("compile (miss)", jsonnet.compile_ci_file, filename, main, files.get)
+    timed("compile (hit)", jsonnet.compile_ci_file, filename, main, files.get)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
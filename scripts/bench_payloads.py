@@ -0,0 +1,109 @@
+"""
+Size and serialization cost of the task payloads, raw hooks vs envelopes.
+
+    python scripts/bench_payloads.py [iterations]
+
+For each fixture of tests/data, builds the message body Celery sends for the
+task (args, kwargs and the link_error signature) and measures its size, the
+size held by the Redis broker (the body is base64 encoded in the message)
+and the dumps/loads time with the configured serializer.
+"""
+import base64
+import json
+import os
+import sys
+import time
+
+from kombu.serialization import dumps, loads
+
+from hub2labhook.config import FFCONFIG
+from hub2labhook.github.models.check import CheckStatus
+from hub2labhook.github.models.envelope import envelope
+from hub2labhook.github.models.event import GithubEvent
+from hub2labhook.jobs import celeryconfig
+from hub2labhook.jobs.tasks import (
+    pipeline,
+    update_github_check,
+    update_github_statuses_failure,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "tests", "data")
+
+GITHUB_FIXTURES = [
+    ("pull_request", "pull_request"),
+    ("unlabeled", "pull_request"),
+    ("push", "push"),
+    ("push_cnr", "push"),
+]
+GITLAB_FIXTURES = ["gitlab/pipeline-hook", "gitlab/pipeline-hook2", "gitlab/build-hook"]
+
+
+def fixture(name):
+    with open(os.path.join(DATA, name + ".json")) as f:
+        return json.load(f)
+
+
+def message_body(signature):
+    errbacks = signature.options.get("link_error")
+    embed = {"callbacks": None, "errbacks": errbacks, "chain": None, "chord": None}
+    return [list(signature.args), signature.kwargs, embed]
+
+
+def github_tasks(event, headers, compact):
+    if compact:
+        event, headers = envelope(GithubEvent(event, headers)), ()
+    else:
+        headers = (headers,)
+    task = pipeline.s(event, *headers)
+    task.link_error(update_github_statuses_failure.s(event, *headers))
+    return task
+
+
+def measure(label, body, iterations):
+    serializer = celeryconfig.task_serializer
+    content_type, encoding, payload = dumps(body, serializer=serializer)
+    if not isinstance(payload, bytes):
+        payload = payload.encode("utf-8")
+    start = time.time()
+    for _ in range(iterations):
+        dumps(body, serializer=serializer)
+    dumps_ms = (time.time() - start) * 1000.0 / iterations
+    start = time.time()
+    for _ in range(iterations):
+        loads(payload, content_type, encoding)
+    loads_ms = (time.time() - start) * 1000.0 / iterations
+    broker = len(base64.b64encode(payload))
+    print(
+        "%-36s %9d %9d %9.3f %9.3f"
+        % (label, len(payload), broker, dumps_ms, loads_ms)
+    )
+
+
+def main(iterations=200):
+    FFCONFIG.failfast["redis_url"] = None
+    print(
+        "%-36s %9s %9s %9s %9s"
+        % ("payload", "bytes", "broker", "dumps ms", "loads ms")
+    )
+    for name, event_type in GITHUB_FIXTURES:
+        headers = {"X-GitHub-Event": event_type, "X-GitHub-Delivery": "bench"}
+        event = fixture(name)
+        for compact in (False, True):
+            body = message_body(github_tasks(event, headers, compact))
+            label = "pipeline %s (%s)" % (name, "envelope" if compact else "raw")
+            measure(label, body, iterations)
+    for name in GITLAB_FIXTURES:
+        event = fixture(name)
+        for compact in (False, True):
+            if compact:
+                event = CheckStatus.compact(event)
+            body = message_body(update_github_check.s(event))
+            label = "check %s (%s)" % (
+                name.split("/")[-1],
+                "compact" if compact else "raw",
+            )
+            measure(label, body, iterations)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
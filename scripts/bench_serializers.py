@@ -0,0 +1,91 @@
+"""
+Encode/decode time and broker bytes of the task serializers.
+
+    python scripts/bench_serializers.py [iterations] [builds]
+
+Serializes each fixture of tests/data, and a pipeline hook grown to `builds`
+builds, as the body of an update_github_check message with JSON and with
+ffci-msgpack (uncompressed, zlib, zstd). The Redis transport stores the
+bodies base64 encoded, "broker" is that size.
+"""
+import base64
+import copy
+import glob
+import json
+import os
+import sys
+import time
+
+from kombu.serialization import dumps as kombu_dumps
+
+from hub2labhook.jobs import serializers
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "tests", "data")
+
+ROW = "%-28s %-14s %9d %9d %9.3f %9.3f"
+
+
+def fixtures(builds):
+    payloads = []
+    paths = glob.glob(os.path.join(DATA, "*.json"))
+    paths += glob.glob(os.path.join(DATA, "gitlab", "*.json"))
+    for path in sorted(paths):
+        with open(path) as f:
+            try:
+                payloads.append((os.path.relpath(path, DATA), json.load(f)))
+            except ValueError:
+                continue
+    with open(os.path.join(DATA, "gitlab", "pipeline-hook.json")) as f:
+        hook = json.load(f)
+    template = hook["builds"]
+    hook["builds"] = []
+    for i in range(builds):
+        build = copy.deepcopy(template[i % len(template)])
+        build["id"] += i
+        build["name"] = "%s-%s" % (build["name"], i)
+        hook["builds"].append(build)
+    payloads.append(("pipeline-hook x%s builds" % builds, hook))
+    return payloads
+
+
+def json_dumps(body):
+    return kombu_dumps(body, serializer="json")[2].encode("utf-8")
+
+
+def codecs():
+    yield "json", json_dumps, json.loads
+    for compression in ("none", "zlib", "zstd"):
+        yield (
+            "msgpack/%s" % compression,
+            lambda body, c=compression: serializers.dumps(body, compression=c),
+            serializers.loads,
+        )
+
+
+def timed(func, arg, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        result = func(arg)
+    return result, (time.time() - start) * 1000.0 / iterations
+
+
+def main(iterations=200, builds=500):
+    if not serializers.available():
+        sys.exit("msgpack isn't installed")
+    print(
+        ROW.replace("d", "s").replace(".3f", "s")
+        % ("payload", "serializer", "bytes", "broker", "encode ms", "decode ms")
+    )
+    embed = {"callbacks": None, "errbacks": None, "chain": None, "chord": None}
+    for name, payload in fixtures(builds):
+        # body of a task message: args, kwargs, embed
+        body = [[payload], {}, embed]
+        for label, encode, decode in codecs():
+            data, encode_ms = timed(encode, body, iterations)
+            _, decode_ms = timed(decode, data, iterations)
+            broker = len(base64.b64encode(data))
+            print(ROW % (name, label, len(data), broker, encode_ms, decode_ms))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
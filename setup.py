@@ -14,6 +14,7 @@ with open('README.md') as readme_file:
 requirements = [
     'futures',
     'celery[redis]',
+    'redis',
     'iziconf',
     'requests',
     'flask',
@@ -22,7 +23,7 @@ requirements = [
     'PyJWT',
     'PyYaml',
     'gitpython',
-    'cryptography',
+    'cryptography>=3.1',
     'celery',
     'flower',
     'mypy',
@@ -59,6 +60,10 @@ setup(
                  'hub2labhook'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        "jsonnet": ["jsonnet"],
+        "msgpack": ["msgpack", "zstandard"],
+    },
     license="Apache License version 2",
     zip_safe=False,
     keywords=['hub2lab-hook'],
@@ -75,3 +75,10 @@ def pr_data():
 @pytest.fixture(scope="session")
 def push_data():
     return get_request('push')
+
+
+@pytest.fixture(autouse=True)
+def noredis(monkeypatch):
+    # the shared caches use their local fallback instead of reaching redis
+    from hub2labhook.config import FFCONFIG
+    monkeypatch.setitem(FFCONFIG.failfast, "redis_url", None)
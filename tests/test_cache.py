@@ -0,0 +1,60 @@
+import time
+from hub2labhook.cache import LRUCache, SharedCache
+import hub2labhook.github.client as ghclient
+
+
+def test_lrucache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lrucache_expires():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    time.sleep(0.02)
+    assert cache.get("a", "miss") == "miss"
+    assert cache.get("b") == 2
+
+
+def test_sharedcache_without_redis():
+    cache = SharedCache("test", ttl=60)
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    cache.delete("k")
+    assert cache.get("k") is None
+
+
+def test_installation_token_shared_between_clients(monkeypatch, requests_mock):
+    ghclient.INSTALLATION_TOKENS.local.clear()
+    monkeypatch.setattr(ghclient, "app_jwt", lambda *args: "jwt")
+    monkeypatch.setenv("GITHUB_INTEGRATION_PEM", "")
+    expires_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+    mock = requests_mock.post(
+        "https://api.github.com/app/installations/42/access_tokens",
+        json={"token": "tok1", "expires_at": expires_at},
+    )
+    assert ghclient.GithubClient(42).token == "tok1"
+    assert ghclient.GithubClient(42).token == "tok1"
+    assert mock.call_count == 1
+
+
+def test_installation_token_refreshed_before_expiry(monkeypatch, requests_mock):
+    ghclient.INSTALLATION_TOKENS.local.clear()
+    monkeypatch.setattr(ghclient, "app_jwt", lambda *args: "jwt")
+    monkeypatch.setenv("GITHUB_INTEGRATION_PEM", "")
+    expires_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 60))
+    mock = requests_mock.post(
+        "https://api.github.com/app/installations/43/access_tokens",
+        json={"token": "tok", "expires_at": expires_at},
+    )
+    ghclient.GithubClient(43).token
+    ghclient.GithubClient(43).token
+    assert mock.call_count == 2
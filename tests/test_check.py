@@ -54,3 +54,49 @@ def test_checkstatus_pipeline_text(pipeline_hook_data):
 def test_checkstatus_pipeline2_text(pipeline_hook2_data):
     check = CheckStatus(pipeline_hook2_data)
     assert isinstance(check.check_pipeline_text(), str)
+
+
+def test_checkstatus_check_key(build_hook_data, pipeline_hook_data):
+    assert CheckStatus(build_hook_data).check_key == "4799622:build:92764974"
+    assert CheckStatus(pipeline_hook_data).check_key.endswith(":pipeline:14650392")
+
+
+def test_checkstatus_state_order(build_hook_data):
+    success = CheckStatus(build_hook_data)
+    running = CheckStatus(
+        dict(build_hook_data, build_status="running", build_finished_at=None)
+    )
+    created = CheckStatus(
+        dict(build_hook_data, build_status="created", build_started_at=None, build_finished_at=None)
+    )
+    assert created.state_order < running.state_order < success.state_order
+
+
+def test_checkstatus_build_summary_deterministic(build_hook_data):
+    assert CheckStatus(build_hook_data).check_summary() == CheckStatus(build_hook_data).check_summary()
+    assert CheckStatus(build_hook_data).render_check() == CheckStatus(build_hook_data).render_check()
+
+
+def test_pipeline_text_stable_while_running(pipeline_hook_data, monkeypatch):
+    import copy
+
+    hook = copy.deepcopy(pipeline_hook_data)
+    hook["builds"][0]["finished_at"] = None
+    hook["builds"][0]["status"] = "running"
+    check = CheckStatus(hook)
+    monkeypatch.setattr(CheckStatus, "ztime", classmethod(lambda cls, t=None: "2017-12-02T15:00:00Z"))
+    first = check.check_pipeline_text()
+    monkeypatch.setattr(CheckStatus, "ztime", classmethod(lambda cls, t=None: "2017-12-02T16:00:00Z"))
+    assert check.check_pipeline_text() == first
+
+
+def test_pipeline_retry_state_order(pipeline_hook_data):
+    import copy
+
+    failed = CheckStatus(pipeline_hook_data)
+    retry = copy.deepcopy(pipeline_hook_data)
+    retry["object_attributes"].update(status="running", finished_at=None)
+    retry["builds"].append(
+        dict(retry["builds"][0], id=1, status="running", created_at="2017-12-03T10:00:00.000Z")
+    )
+    assert failed.state_order < CheckStatus(retry).state_order
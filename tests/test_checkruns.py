@@ -0,0 +1,136 @@
+import pytest
+import requests
+from hub2labhook.github.models.check import CheckStatus
+from hub2labhook.github import checkruns
+
+
+class FakeGithub(object):
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.missing = set()
+
+    def create_check(self, repo, check):
+        self.created.append(check)
+        return {"id": len(self.created)}
+
+    def update_check_run(self, repo, check, check_id):
+        if check_id in self.missing:
+            resp = requests.Response()
+            resp.status_code = 404
+            raise requests.exceptions.HTTPError("404", response=resp)
+        self.updated.append((check_id, check))
+        return {"id": check_id}
+
+
+@pytest.fixture()
+def github():
+    checkruns.CHECK_RUN_IDS.local.clear()
+    checkruns.PAYLOAD_DIGESTS.local.clear()
+    return FakeGithub()
+
+
+def test_publish_check_updates_existing_run(github, build_hook_data):
+    status = CheckStatus(build_hook_data)
+    check = {"name": "job", "head_sha": "abc", "status": "in_progress"}
+    checkruns.publish_check(github, "a/b", status, check)
+    checkruns.publish_check(github, "a/b", status, dict(check, status="completed"))
+    assert len(github.created) == 1
+    assert github.updated == [(1, {"name": "job", "status": "completed"})]
+
+
+def test_publish_check_recreates_deleted_run(github, build_hook_data):
+    status = CheckStatus(build_hook_data)
+    checkruns.publish_check(github, "a/b", status, {"name": "job"})
+    github.missing.add(1)
+    assert checkruns.publish_check(github, "a/b", status, {"name": "job2"}) == {"id": 2}
+    assert checkruns.CHECK_RUN_IDS.get(status.check_key) == 2
+
+
+def _status(data, status, finished_at):
+    return CheckStatus(dict(data, build_status=status, build_finished_at=finished_at))
+
+
+def test_advance_state_drops_older_events(github, build_hook_data):
+    checkruns._local_states.clear()
+    running = _status(build_hook_data, "running", None)
+    success = _status(build_hook_data, "success", "2018-08-28 14:57:26 UTC")
+    assert checkruns.advance_state(running) is True
+    assert checkruns.advance_state(success) is True
+    assert checkruns.advance_state(running) is False
+    assert checkruns.advance_state(success) is True
+
+
+def test_advance_state_redis(monkeypatch, build_hook_data):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(checkruns, "redis_client", lambda: client)
+    running = _status(build_hook_data, "running", None)
+    success = _status(build_hook_data, "success", "2018-08-28 14:57:26 UTC")
+    assert checkruns.advance_state(success) is True
+    assert checkruns.advance_state(running) is False
+
+
+def test_publish_check_skips_unchanged_payload(github, build_hook_data):
+    status = CheckStatus(build_hook_data)
+    check = status.render_check()
+    checkruns.publish_check(github, "a/b", status, check)
+    checkruns.publish_check(github, "a/b", status, check)
+    assert len(github.created) == 1
+    assert github.updated == []
+    checkruns.publish_check(github, "a/b", status, dict(check, status="in_progress"))
+    assert len(github.updated) == 1
+
+
+def test_state_claimed_before_publish(github, build_hook_data, monkeypatch):
+    from hub2labhook.jobs import tasks
+
+    checkruns._local_states.clear()
+
+    class Gitlab(object):
+        def get_github_target(self, project_id):
+            return {"github_repo": "a/b", "installation_id": 1}
+
+    def failing(*args):
+        raise requests.exceptions.ConnectionError("github is down")
+
+    monkeypatch.setattr(tasks, "GitlabClient", Gitlab)
+    monkeypatch.setattr(tasks, "GithubClient", lambda installation_id: github)
+    monkeypatch.setattr(tasks, "publish_check", failing)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        tasks.update_github_check(build_hook_data)
+    # an older event processed meanwhile isn't sent
+    running = dict(build_hook_data, build_status="running", build_finished_at=None)
+    assert tasks.update_github_check(running) is None
+    # the retry of the claimed event is
+    monkeypatch.setattr(tasks, "publish_check", checkruns.publish_check)
+    tasks.update_github_check(build_hook_data)
+    assert len(github.created) == 1
+
+
+def test_github_sha_without_redis_mapping(github, pipeline_hook_data, build_hook_data):
+    sha = "de92e9d03327bbbd809984ee60d0aefd62a3ec5f"
+    message = checkruns.generated_commit_message("ci.jsonnet", sha)
+    # the mapping expired: read from the generated commit
+    checkruns.CI_SHAS.local.clear()
+    assert checkruns.github_sha("a" * 40, message) == sha
+    assert checkruns.github_sha("a" * 40, "fix the build\n") == "a" * 40
+    build = CheckStatus(dict(build_hook_data, commit={"message": message}))
+    assert build.sha == sha
+    pipeline = dict(pipeline_hook_data)
+    pipeline["object_attributes"] = dict(
+        pipeline_hook_data["object_attributes"], variables=[{"key": "SHA", "value": sha}]
+    )
+    assert CheckStatus(pipeline).sha == sha
+    assert CheckStatus(CheckStatus.compact(pipeline)).sha == sha
+
+
+def test_github_sha_lookup_misses_cached(github, monkeypatch):
+    checkruns._unmapped_shas.clear()
+    lookups = []
+    monkeypatch.setattr(checkruns.CI_SHAS, "get", lambda key: lookups.append(key))
+    assert checkruns.github_sha("b" * 40) == "b" * 40
+    assert checkruns.github_sha("b" * 40) == "b" * 40
+    assert lookups == ["b" * 40]
+    checkruns.map_ci_sha("b" * 40, "c" * 40)
+    assert checkruns._unmapped_shas.get("b" * 40) is None
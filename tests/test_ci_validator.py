@@ -0,0 +1,96 @@
+import yaml
+from hub2labhook.gitlab.ci_validator import validate
+
+
+def test_valid_ci_file():
+    content = yaml.safe_load(
+        """
+stages: [build, test]
+variables: {A: "1"}
+.base:
+  image: python
+  stage: test
+build:
+  stage: build
+  script: make
+test:
+  extends: .base
+  script: [make test]
+downstream:
+  stage: test
+  trigger: group/project
+"""
+    )
+    assert validate(content) == []
+
+
+def test_invalid_ci_file():
+    content = yaml.safe_load(
+        """
+stages: [build]
+nojob: 1
+noscript:
+  stage: build
+badstage:
+  stage: deploy
+  script: make
+badextends:
+  extends: .missing
+loop1:
+  extends: loop2
+  script: a
+loop2:
+  extends: loop1
+"""
+    )
+    errors = validate(content)
+    assert "nojob: a job must be a mapping, got int" in errors
+    assert "noscript: a job needs a script or a trigger" in errors
+    assert "badstage: stage 'deploy' isn't declared in stages" in errors
+    assert "badextends: extends unknown job '.missing'" in errors
+    assert "loop1: circular extends: loop1 -> loop2 -> loop1" in errors
+    assert validate(["job"]) == ["the CI file must be a mapping of jobs and settings"]
+
+
+def test_extends_from_include():
+    content = {
+        "include": [{"project": "group/templates", "file": "ci.yml"}, "/local.yml"],
+        "job": {"extends": ".template"},
+    }
+    assert validate(content) == []
+    assert len(validate({"include": [{"unknown": "x"}]})) == 1
+
+
+def test_stages_and_jobs_from_include():
+    content = {
+        "include": [{"project": "g/t", "file": "ci.yml"}],
+        "lint": {"stage": "lint", "script": "x"},
+    }
+    assert validate(content) == []
+    content = {"include": "/base.yml", "test": {"variables": {"DEBUG": "1"}}}
+    assert validate(content) == []
+    # stages declared here replace the included ones
+    content = {
+        "include": "/base.yml",
+        "stages": ["test"],
+        "lint": {"stage": "lint", "script": "x"},
+    }
+    assert validate(content) == ["lint: stage 'lint' isn't declared in stages"]
+
+
+def test_malformed_stage_and_extends():
+    content = yaml.safe_load(
+        """
+liststage:
+  stage: [test]
+  script: make
+nestedextends:
+  extends: [[.t]]
+  script: make
+.t:
+  script: make
+"""
+    )
+    errors = validate(content)
+    assert "liststage: stage must be a name" in errors
+    assert "nestedextends: extends must be a job name or a list of job names" in errors
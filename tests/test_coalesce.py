@@ -0,0 +1,48 @@
+import pytest
+from hub2labhook.jobs import coalesce
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture()
+def coalescer(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(coalesce, "redis_client", lambda: client)
+    return coalesce.EventCoalescer(2)
+
+
+def test_coalescer_keeps_most_advanced_event(coalescer):
+    assert coalescer.offer("1:build:2", "05||t1", {"status": "running"}) is True
+    assert coalescer.offer("1:build:2", "06|t2|t1", {"status": "success"}) is False
+    assert coalescer.offer("1:build:2", "05||t1", {"status": "running"}) is False
+    assert coalescer.take("1:build:2") == {"status": "success"}
+    assert coalescer.take("1:build:2") is None
+
+
+def test_coalescer_schedules_again_after_flush(coalescer):
+    assert coalescer.offer("1:build:2", "05||t1", {"status": "running"}) is True
+    coalescer.take("1:build:2")
+    assert coalescer.offer("1:build:2", "06|t2|t1", {"status": "success"}) is True
+
+
+def test_coalescer_disabled_without_window(coalescer):
+    assert coalesce.EventCoalescer(0).enabled is False
+
+
+def test_flush_holds_the_event_again_on_failure(coalescer, monkeypatch, build_hook_data):
+    import requests
+    from hub2labhook.config import FFCONFIG
+    from hub2labhook.github.models.check import CheckStatus
+    from hub2labhook.jobs import tasks
+
+    monkeypatch.setitem(FFCONFIG.failfast, "coalesce_window", 2)
+    check = CheckStatus(build_hook_data)
+    assert coalescer.offer(check.check_key, check.state_order, build_hook_data)
+
+    def failing(event):
+        raise requests.exceptions.ConnectionError("github is down")
+
+    monkeypatch.setattr(tasks, "update_github_check", failing)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        tasks.flush_gitlab_event(check.check_key)
+    assert coalescer.take(check.check_key) == build_hook_data
@@ -0,0 +1,57 @@
+import json
+import pytest
+from hub2labhook.api import deliveries
+from hub2labhook.config import FFCONFIG
+import hub2labhook.jobs.tasks as tasks
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeJob(object):
+    id = "job-1"
+
+
+@pytest.fixture()
+def client(app, monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(deliveries, "redis_client", lambda: redis)
+    monkeypatch.setitem(FFCONFIG.github, "secret_token", None)
+    return app.test_client()
+
+
+def test_github_redelivery_acknowledged(client, monkeypatch, pr_data, pr_headers):
+    queued = []
+    monkeypatch.setattr(
+        tasks.route_event, "delay", lambda *args: queued.append(args) or FakeJob()
+    )
+    body = json.dumps(pr_data)
+    resp = client.post("/api/v1/github_event", data=body, headers=pr_headers)
+    assert resp.status_code == 202
+    assert resp.get_json() == {"job_id": "job-1"}
+    resp = client.post("/api/v1/github_event", data=body, headers=pr_headers)
+    assert resp.get_json() == {"duplicate": True}
+    assert queued == [
+        (
+            body,
+            {
+                "X-GitHub-Event": "pull_request",
+                "X-GitHub-Delivery": "5ca32b80-c638-11e6-8213-373827616e33",
+            },
+        )
+    ]
+
+
+def test_failed_delivery_released(client, monkeypatch, build_hook_data):
+    def coalesce(event):
+        raise IOError("broker down")
+
+    headers = {"X-Gitlab-Event": "Job Hook"}
+    body = json.dumps(build_hook_data)
+    monkeypatch.setattr(tasks, "coalesce_gitlab_event", coalesce)
+    resp = client.post("/api/v1/gitlab_event", data=body, headers=headers)
+    assert resp.status_code == 500
+    monkeypatch.setattr(tasks, "coalesce_gitlab_event", lambda event: None)
+    resp = client.post("/api/v1/gitlab_event", data=body, headers=headers)
+    assert resp.get_json() == {"coalesced": True}
+    resp = client.post("/api/v1/gitlab_event", data=body, headers=headers)
+    assert resp.get_json() == {"duplicate": True}
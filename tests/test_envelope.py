@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from hub2labhook.exception import Unexpected, Unsupported
+from hub2labhook.github.models.check import CheckStatus
+from hub2labhook.github.models.envelope import (
+    ENVELOPE_FIELDS,
+    EventEnvelope,
+    envelope,
+    load_event,
+)
+from hub2labhook.github.models.event import GithubEvent
+
+
+@pytest.mark.parametrize("data,headers", [("pr_data", "pr_headers"), ("push_data", "push_headers")])
+def test_envelope_same_fields(data, headers, request):
+    gevent = GithubEvent(request.getfixturevalue(data), request.getfixturevalue(headers))
+    compact = json.loads(json.dumps(envelope(gevent)))
+    loaded = load_event(compact)
+    assert isinstance(loaded, EventEnvelope)
+    for field in ENVELOPE_FIELDS:
+        try:
+            expected = getattr(gevent, field)
+        except (KeyError, Unsupported):
+            expected = None
+        assert getattr(loaded, field) == expected
+    assert len(json.dumps(compact)) < 1024
+
+
+def test_envelope_unsupported_fields(ping_data, ping_headers):
+    compact = envelope(GithubEvent(ping_data, ping_headers))
+    assert compact["event_type"] == "ping"
+    assert compact["head_sha"] is None
+
+
+def test_load_event_raw_hook(pr_data, pr_headers):
+    gevent = load_event(pr_data, pr_headers)
+    assert isinstance(gevent, GithubEvent)
+    assert gevent.head_sha == "495d0b659a0a78855183135c5d427ce79ac43552"
+
+
+def test_envelope_unknown_version(pr_data, pr_headers):
+    compact = envelope(GithubEvent(pr_data, pr_headers))
+    compact["v"] = 99
+    with pytest.raises(Unsupported):
+        load_event(compact)
+
+
+def test_envelope_unknown_attribute(pr_data, pr_headers):
+    loaded = load_event(envelope(GithubEvent(pr_data, pr_headers)))
+    with pytest.raises(AttributeError):
+        loaded.event
+
+
+@pytest.mark.parametrize("data", ["pipeline_hook_data", "pipeline_hook2_data", "build_hook_data"])
+def test_checkstatus_compact(data, request):
+    hook = request.getfixturevalue(data)
+    compact = CheckStatus.compact(hook)
+    assert len(json.dumps(compact)) < len(json.dumps(hook))
+    full, small = CheckStatus(hook), CheckStatus(json.loads(json.dumps(compact)))
+    assert small.check_key == full.check_key
+    assert small.external_id == full.external_id
+    assert small.state_order == full.state_order
+    assert small.render_pipeline_status() == full.render_pipeline_status()
+    assert small.check_output() == full.check_output()
+
+
+def test_checkstatus_compact_unknown_kind():
+    with pytest.raises(Unexpected):
+        CheckStatus.compact({"object_kind": "note"})
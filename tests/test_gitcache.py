@@ -0,0 +1,76 @@
+import os
+import pytest
+from git import Repo
+from hub2labhook.gitcache import MirrorCache
+
+
+@pytest.fixture()
+def source(tmp_path):
+    repo = Repo.init(str(tmp_path / "source"))
+    with repo.config_writer() as cfg:
+        cfg.set_value("user", "name", "test")
+        cfg.set_value("user", "email", "test@example.com")
+    (tmp_path / "source" / "README.md").write_text("test")
+    repo.index.add(["README.md"])
+    commit = repo.index.commit("init")
+    repo.git.update_ref("refs/pull/1/head", commit.hexsha)
+    return repo
+
+
+def test_mirror_clone(tmp_path, source):
+    cache = MirrorCache(str(tmp_path / "mirrors"), budget=10 * 1024**2)
+    refspecs = ["+refs/heads/*:refs/heads/*", "+refs/pull/1/head:refs/pull/1/head"]
+    for i in range(2):
+        dest = str(tmp_path / ("build%s" % i))
+        clone = cache.clone("org/repo", source.working_dir, dest, refspecs)
+        clone.git.fetch("origin", "pull/1/head:pr-1")
+        assert clone.git.rev_parse("pr-1") == source.head.commit.hexsha
+    assert sorted(os.listdir(str(tmp_path / "mirrors"))) == [
+        "org__repo.git",
+        "org__repo.git.lock",
+        "org__repo.git.size",
+    ]
+
+
+def test_mirror_eviction(tmp_path, source):
+    cache = MirrorCache(str(tmp_path / "mirrors"), budget=0)
+    dest = str(tmp_path / "build")
+    cache.clone("org/repo", source.working_dir, dest, ["+refs/heads/*:refs/heads/*"])
+    assert not os.path.exists(cache.path("org/repo"))
+    assert os.listdir(str(tmp_path / "mirrors")) == []
+    assert os.path.exists(os.path.join(dest, "README.md"))
+
+
+def test_mirror_not_evicted_before_clone(tmp_path, source, monkeypatch):
+    from hub2labhook import gitcache
+
+    cache = MirrorCache(str(tmp_path / "mirrors"), budget=10 * 1024**2)
+    # another worker evicting everything between the fetch and the clone
+    other = MirrorCache(str(tmp_path / "mirrors"), budget=0)
+    clone_from = Repo.clone_from
+
+    def evicted_first(path, dest, **kwargs):
+        other.evict()
+        return clone_from(path, dest, **kwargs)
+
+    monkeypatch.setattr(gitcache.Repo, "clone_from", evicted_first)
+    dest = str(tmp_path / "build")
+    cache.clone("org/repo", source.working_dir, dest, ["+refs/heads/*:refs/heads/*"])
+    assert os.path.exists(os.path.join(dest, "README.md"))
+
+
+def test_eviction_reuses_sizes(tmp_path, source, monkeypatch):
+    cache = MirrorCache(str(tmp_path / "mirrors"), budget=10 * 1024**2)
+    measured = []
+    disk_usage = MirrorCache.disk_usage
+
+    def counted(path):
+        measured.append(os.path.basename(path))
+        return disk_usage(path)
+
+    monkeypatch.setattr(cache, "disk_usage", counted)
+    refspecs = ["+refs/heads/*:refs/heads/*"]
+    for i, repo in enumerate(["org/a", "org/b", "org/a"]):
+        cache.clone(repo, source.working_dir, str(tmp_path / ("build%s" % i)), refspecs)
+    # once per fetch, of the fetched mirror only
+    assert measured == ["org__a.git", "org__b.git", "org__a.git"]
@@ -0,0 +1,132 @@
+import pytest
+import requests
+from hub2labhook.gitlab.client import GitlabClient, PROJECTS
+
+PROJECT = {"id": 12, "path_with_namespace": "failfast-ci/Repo", "web_url": "https://gitlab.com/failfast-ci/repo"}
+
+
+@pytest.fixture()
+def gitlab():
+    PROJECTS.clear()
+    return GitlabClient("https://gitlab.example.com", token="t")
+
+
+def test_project_id_resolved_once(gitlab, requests_mock):
+    mock = requests_mock.get(
+        "https://gitlab.example.com/api/v4/projects/failfast-ci%2frepo", json=PROJECT
+    )
+    assert gitlab.get_project_id("failfast-ci/repo") == 12
+    assert gitlab.get_project_id("failfast-ci/repo") == 12
+    assert gitlab.get_project(12) == PROJECT
+    assert mock.call_count == 1
+
+
+def test_project_forgotten_on_404(gitlab, requests_mock):
+    requests_mock.get(
+        "https://gitlab.example.com/api/v4/projects/failfast-ci%2frepo", json=PROJECT
+    )
+    requests_mock.get(
+        "https://gitlab.example.com/api/v4/projects/12/variables/KEY",
+        status_code=404,
+        json={"message": "404 Variable Not Found"},
+    )
+    gitlab.get_project_id("failfast-ci/repo")
+    # a missing resource of the project keeps it
+    with pytest.raises(requests.exceptions.HTTPError):
+        gitlab.get_variable("failfast-ci/repo", "KEY")
+    assert len(PROJECTS) == 2
+    requests_mock.get(
+        "https://gitlab.example.com/api/v4/projects/12/variables/KEY",
+        status_code=404,
+        json={"message": "404 Project Not Found"},
+    )
+    with pytest.raises(requests.exceptions.HTTPError):
+        gitlab.get_variable("failfast-ci/repo", "KEY")
+    assert len(PROJECTS) == 0
+
+
+def test_github_target_cached(gitlab, requests_mock):
+    from hub2labhook.gitlab.client import GITHUB_TARGETS
+
+    GITHUB_TARGETS.local.clear()
+    base = "https://gitlab.example.com/api/v4/projects/12/variables/"
+    installation = requests_mock.get(
+        base + "GITHUB_INSTALLATION_ID", json={"value": "42"}
+    )
+    requests_mock.get(base + "GITHUB_REPO", json={"value": "failfast-ci/repo"})
+    for _ in range(3):
+        assert gitlab.get_github_target(12) == {
+            "installation_id": "42",
+            "github_repo": "failfast-ci/repo",
+        }
+    assert installation.call_count == 1
+
+
+def test_lint_cached_by_content(gitlab, requests_mock):
+    from hub2labhook.gitlab.client import LINT_RESULTS
+
+    LINT_RESULTS.local.clear()
+    mock = requests_mock.post(
+        "https://gitlab.example.com/api/v4/ci/lint",
+        [{"status_code": 500, "json": {"message": "error"}},
+         {"json": {"status": "valid", "errors": []}}],
+    )
+    assert gitlab.gitlabci_lint("job: {script: [a]}") == {"message": "error"}
+    assert gitlab.gitlabci_lint("job: {script: [a]}")["status"] == "valid"
+    assert gitlab.gitlabci_lint("job: {script: [a]}")["status"] == "valid"
+    assert mock.call_count == 2
+    gitlab.gitlabci_lint("job: {script: [b]}")
+    assert mock.call_count == 3
+
+
+def test_initialize_project_polls_then_cached(gitlab, requests_mock, monkeypatch):
+    from hub2labhook.gitlab import client
+
+    client.INITIALIZED_PROJECTS.local.clear()
+    sleeps = []
+    monkeypatch.setattr(client.time, "sleep", sleeps.append)
+    project = dict(PROJECT, http_url_to_repo="https://gitlab.example.com/repo.git")
+    gitlab._cache_project(project)
+    base = "https://gitlab.example.com/api/v4/projects/12/repository/"
+    master = requests_mock.get(
+        base + "branches/master",
+        [{"status_code": 404}, {"status_code": 404}, {"json": {"name": "master"}}],
+    )
+    requests_mock.post(base + "branches", status_code=201, json={})
+    requests_mock.post(
+        base + "files/README.md",
+        [{"status_code": 500}, {"status_code": 201, "json": {}}],
+    )
+    requests_mock.put(base + "branches/master/unprotect", json={})
+    assert gitlab.initialize_project("repo", "failfast-ci") == project
+    assert master.call_count == 3
+    assert sleeps == [0.25, 0.25]
+    calls = requests_mock.call_count
+    assert gitlab.initialize_project("repo", "failfast-ci") == project
+    assert requests_mock.call_count == calls
+
+
+def test_poll_raises_auth_errors_at_once(monkeypatch):
+    import pytest
+    import requests
+    from hub2labhook.gitlab import client
+
+    sleeps = []
+    monkeypatch.setattr(client.time, "sleep", sleeps.append)
+
+    def failing(status):
+        response = requests.Response()
+        response.status_code = status
+
+        def func():
+            raise requests.exceptions.HTTPError(response=response)
+
+        return func
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.poll(failing(403), timeout=10, delay=1)
+    assert sleeps == []
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.poll(failing(503), timeout=10, delay=1)
+    # the clock is frozen: only the delay reaches the timeout
+    assert sleeps == [1, 2, 4, 8]
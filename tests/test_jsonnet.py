@@ -0,0 +1,77 @@
+import pytest
+from hub2labhook import jsonnet
+from hub2labhook.exception import InvalidParams
+
+FILES = {
+    "ci/jobs.libsonnet": 'local base = import "base.libsonnet"; {job(n): base + {script: [n]}}',
+    "ci/base.libsonnet": '{stage: "test"}',
+    "ci/cmd.txt": "make test",
+}
+
+MAIN = """
+// import "commented.libsonnet"
+local jobs = import "ci/jobs.libsonnet";
+{stages: ["test"], test: jobs.job(importstr 'ci/cmd.txt')}
+"""
+
+
+@pytest.fixture()
+def fetched():
+    jsonnet.COMPILED.local.clear()
+    calls = []
+
+    def fetch(path):
+        calls.append(path)
+        return FILES.get(path)
+
+    fetch.calls = calls
+    return fetch
+
+
+def test_fetch_sources_follows_imports(fetched):
+    sources = jsonnet.fetch_sources(".failfast-ci.jsonnet", MAIN, fetched)
+    assert sorted(sources) == [".failfast-ci.jsonnet"] + sorted(FILES)
+    assert "commented.libsonnet" in fetched.calls
+    with pytest.raises(InvalidParams):
+        jsonnet.fetch_sources(".failfast-ci.jsonnet", MAIN, fetched, max_imports=2)
+
+
+def test_compile_cached_by_sources(fetched, monkeypatch):
+    pytest.importorskip("_jsonnet")
+    expected = {"stages": ["test"], "test": {"stage": "test", "script": ["make test"]}}
+    assert jsonnet.compile_ci_file(".failfast-ci.jsonnet", MAIN, fetched) == expected
+
+    def evaluate(*args, **kwargs):
+        raise AssertionError("evaluated again")
+
+    monkeypatch.setattr(jsonnet, "evaluate", evaluate)
+    assert jsonnet.compile_ci_file(".failfast-ci.jsonnet", MAIN, fetched) == expected
+    monkeypatch.setitem(FILES, "ci/cmd.txt", "make lint")
+    with pytest.raises(AssertionError):
+        jsonnet.compile_ci_file(".failfast-ci.jsonnet", MAIN, fetched)
+
+
+def test_evaluation_errors(fetched):
+    pytest.importorskip("_jsonnet")
+    with pytest.raises(InvalidParams) as exc:
+        jsonnet.compile_ci_file("ci.jsonnet", "{a: }", fetched)
+    assert "STATIC ERROR" in exc.value.payload["error"]
+    with pytest.raises(InvalidParams) as exc:
+        jsonnet.compile_ci_file("ci.jsonnet", "[1]", fetched)
+    slow = "std.foldl(function(a, b) a + b, std.range(0, 100000000), 0)"
+    with pytest.raises(InvalidParams) as exc:
+        jsonnet.compile_ci_file("ci.jsonnet", slow, fetched, timeout=1)
+    assert exc.value.payload == {"timeout": 1}
+
+
+def test_importbin_in_sources_digest(fetched, monkeypatch):
+    main = 'local key = importbin "ci/key.bin"; {stages: ["test"], size: std.length(key)}'
+    monkeypatch.setitem(FILES, "ci/key.bin", b"\x00\xff\x10".decode("utf-8", "surrogateescape"))
+    sources = jsonnet.fetch_sources(".failfast-ci.jsonnet", main, fetched)
+    assert "ci/key.bin" in sources
+    digest = jsonnet.sources_digest(".failfast-ci.jsonnet", sources)
+    monkeypatch.setitem(FILES, "ci/key.bin", b"\x00\xfe".decode("utf-8", "surrogateescape"))
+    changed = jsonnet.fetch_sources(".failfast-ci.jsonnet", main, fetched)
+    assert jsonnet.sources_digest(".failfast-ci.jsonnet", changed) != digest
+    pytest.importorskip("_jsonnet")
+    assert jsonnet.compile_ci_file(".failfast-ci.jsonnet", main, fetched)["size"] == 2
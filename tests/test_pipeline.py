@@ -0,0 +1,227 @@
+import copy
+import logging
+import threading
+import pytest
+from git import Repo
+from hub2labhook.config import FailFastConfig
+from hub2labhook.exception import InvalidParams, ResourceNotFound, Unexpected
+from hub2labhook.github import checkruns
+from hub2labhook.github.client import GithubClient
+from hub2labhook.github.models.event import GithubEvent
+from hub2labhook.gitlab.client import GitlabClient
+from hub2labhook.pipeline import LogCapture, Pipeline, SYNCED_SHAS
+from hub2labhook.steps import StepGraph
+
+
+@pytest.fixture()
+def source(tmp_path):
+    repo = Repo.init(str(tmp_path / "source"))
+    with repo.config_writer() as cfg:
+        cfg.set_value("user", "name", "test")
+        cfg.set_value("user", "email", "test@example.com")
+    for i in range(3):
+        (tmp_path / "source" / "README.md").write_text("test %s" % i)
+        repo.index.add(["README.md"])
+        commit = repo.index.commit("commit %s" % i)
+    repo.git.update_ref("refs/pull/1/head", commit.hexsha)
+    return repo
+
+
+@pytest.fixture()
+def pipeline(pr_data, pr_headers, monkeypatch):
+    monkeypatch.setattr(GithubClient, "token", "token")
+    config = FailFastConfig()
+    config.failfast["git_cache_dir"] = None
+    return Pipeline(GithubEvent(copy.deepcopy(pr_data), pr_headers), config)
+
+
+def test_clone_options_precedence(pipeline):
+    pipeline.config.failfast["clone"]["repos"] = {
+        "kubernetes-incubator/kargo": {"strategy": "partial"}
+    }
+    assert pipeline.clone_options()["strategy"] == "partial"
+    options = pipeline.clone_options(
+        {"FAILFAST_CLONE_STRATEGY": "shallow", "FAILFAST_CLONE_DEPTH": "1"}
+    )
+    assert options == {"strategy": "shallow", "depth": 1, "skip_lfs": False}
+    with pytest.raises(InvalidParams):
+        pipeline.clone_options({"FAILFAST_CLONE_STRATEGY": "magic"})
+
+
+def test_shallow_checkout_pr(pipeline, source, tmp_path, monkeypatch):
+    gevent = pipeline.ghevent
+    gevent.event["number"] = 1
+    gevent.event["repository"]["clone_url"] = "file://" + source.working_dir
+    gevent.event["pull_request"]["head"]["sha"] = source.head.commit.hexsha
+    ci_variables = {"FAILFAST_CLONE_STRATEGY": "shallow", "FAILFAST_CLONE_DEPTH": "1"}
+    gitbin = pipeline._checkout_repo(gevent, str(tmp_path / "build"), ci_variables)
+    assert gitbin.rev_parse("HEAD") == source.head.commit.hexsha
+    assert gitbin.rev_list("--count", "HEAD") == "1"
+
+
+def test_shallow_checkout_push_default_branch(
+    pipeline, push_data, push_headers, source, tmp_path
+):
+    event = copy.deepcopy(push_data)
+    sha = source.head.commit.hexsha
+    # the branch checked out in the new repository has the same name
+    branch = Repo.init(str(tmp_path / "probe")).active_branch.name
+    source.git.update_ref("refs/heads/%s" % branch, sha)
+    event["ref"] = "refs/heads/%s" % branch
+    event["head_commit"]["id"] = sha
+    event["repository"]["clone_url"] = "file://" + source.working_dir
+    push = Pipeline(GithubEvent(event, push_headers), pipeline.config)
+    ci_variables = {"FAILFAST_CLONE_STRATEGY": "shallow", "FAILFAST_CLONE_DEPTH": "1"}
+    gitbin = push._checkout_repo(push.ghevent, str(tmp_path / "build"), ci_variables)
+    assert gitbin.rev_parse("HEAD") == sha
+    assert gitbin.rev_parse("--abbrev-ref", "HEAD") == branch
+    assert gitbin.rev_list("--count", "HEAD") == "1"
+
+
+@pytest.fixture()
+def synced(pipeline, monkeypatch):
+    SYNCED_SHAS.local.clear()
+    sha = pipeline.ghevent.head_sha
+    ci_ref = pipeline.ghevent.target_refname
+    result = {"ci_project_id": 42, "ci_ref": ci_ref, "ci_sha": sha, "pipeline_id": 1}
+    SYNCED_SHAS.set(
+        pipeline.synced_key, {"gitlab_url": "https://gitlab.com", "result": result}
+    )
+    monkeypatch.setattr(
+        GitlabClient, "get_branch", lambda self, pid, ref: {"commit": {"id": sha}}
+    )
+    return result
+
+
+def test_synced_pipeline_reused(pipeline, synced, monkeypatch):
+    monkeypatch.setattr(
+        GitlabClient,
+        "get_pipelines",
+        lambda self, pid, ref, sha: [{"id": 2, "status": "running"}],
+    )
+    assert pipeline.trigger_pipeline() == dict(synced, pipeline_id=2)
+
+
+def test_synced_pipeline_failed_not_reused(pipeline, synced, monkeypatch):
+    monkeypatch.setattr(
+        GitlabClient,
+        "get_pipelines",
+        lambda self, pid, ref, sha: [{"id": 2, "status": "failed"}],
+    )
+    assert pipeline.find_synced_pipeline() is None
+    monkeypatch.setattr(
+        GitlabClient, "get_branch", lambda self, pid, ref: {"commit": {"id": "other"}}
+    )
+    assert pipeline.find_synced_pipeline() is None
+
+
+def test_push_sync_not_reused_by_pr(pipeline, push_data, push_headers, monkeypatch):
+    SYNCED_SHAS.local.clear()
+    push = Pipeline(GithubEvent(copy.deepcopy(push_data), push_headers), pipeline.config)
+    push.ghevent.event["head_commit"]["id"] = pipeline.ghevent.head_sha
+    push.ghevent.event["repository"]["full_name"] = pipeline.ghevent.repo
+    sha = pipeline.ghevent.head_sha
+    result = {"ci_project_id": 42, "ci_ref": push.ghevent.target_refname, "ci_sha": sha}
+    SYNCED_SHAS.set(push.synced_key, {"gitlab_url": "https://gitlab.com", "result": result})
+    monkeypatch.setattr(
+        GitlabClient, "get_branch", lambda self, pid, ref: {"commit": {"id": sha}}
+    )
+    monkeypatch.setattr(
+        GitlabClient,
+        "get_pipelines",
+        lambda self, pid, ref, sha: [{"id": 2, "status": "running"}],
+    )
+    assert push.find_synced_pipeline() == dict(result, pipeline_id=2)
+    assert pipeline.synced_key != push.synced_key
+    assert pipeline.find_synced_pipeline() is None
+    # a labeled event changes the PR_LABELS of the pipeline
+    event = copy.deepcopy(pipeline.ghevent.event)
+    event["pull_request"]["labels"] = [{"name": "ci-full"}]
+    labeled = Pipeline(GithubEvent(event, {"X-GitHub-Event": "pull_request"}), pipeline.config)
+    assert labeled.synced_key != pipeline.synced_key
+
+
+def test_unknown_sha_not_reused(pipeline):
+    SYNCED_SHAS.local.clear()
+    assert pipeline.find_synced_pipeline() is None
+
+
+def test_missing_ci_file_fails_before_clone(pipeline, tmp_path, monkeypatch):
+    pipeline.config.failfast["workspace_dir"] = str(tmp_path / "ws")
+    updates = []
+    monkeypatch.setattr(
+        GithubClient, "create_check", lambda self, repo, body: dict(body, id=1)
+    )
+    monkeypatch.setattr(
+        GithubClient, "get_checks", lambda self, repo, sha: {"check_runs": []}
+    )
+    monkeypatch.setattr(
+        GithubClient,
+        "update_check_run",
+        lambda self, repo, body, check_id: updates.append(body),
+    )
+
+    def get_ci_file(self, repo, ref):
+        assert ref == pipeline.ghevent.head_sha
+        raise ResourceNotFound("no .gitlab-ci.yml or .failfast-ci.jsonnet")
+
+    def checkout(*args, **kwargs):
+        raise AssertionError("cloned")
+
+    monkeypatch.setattr(GithubClient, "get_ci_file", get_ci_file)
+    monkeypatch.setattr(Pipeline, "_checkout_repo", checkout)
+    with pytest.raises(Unexpected):
+        pipeline.trigger_pipeline()
+    assert updates[-1]["conclusion"] == "failure"
+
+
+def test_generated_ci_file_commit_is_reproducible(pipeline, source, tmp_path):
+    pipeline.ghevent.event["pull_request"]["head"]["sha"] = source.head.commit.hexsha
+    ci_shas = []
+    for name in ["a", "b"]:
+        clone = Repo.clone_from(source.working_dir, str(tmp_path / name))
+        with clone.config_writer() as cfg:
+            cfg.set_value("user", "name", "bot")
+            cfg.set_value("user", "email", "bot@example.com")
+        ci_shas.append(
+            pipeline._commit_gitlab_ci(
+                clone.git, clone.working_dir, "job: {script: [a]}\n", "ci.jsonnet"
+            )
+        )
+    assert ci_shas[0] == ci_shas[1] != source.head.commit.hexsha
+    assert checkruns.github_sha(ci_shas[0]) == source.head.commit.hexsha
+
+
+def test_log_capture_scoped_to_task(caplog):
+    caplog.set_level(logging.INFO)
+    logger = logging.getLogger("hub2labhook.test")
+    other = threading.Thread(target=logger.info, args=("other build",))
+    with LogCapture() as logs:
+        logger.info("this build")
+        other.start()
+        other.join()
+        graph = StepGraph()
+        graph.add("step", lambda: logger.info("in a step"))
+        graph.run()
+    logger.info("after")
+    assert logs.getvalue() == "[INFO]  this build\n[INFO]  in a step\n"
+
+
+def test_log_capture_bounded():
+    with LogCapture(max_chars=100) as logs:
+        for i in range(100):
+            logs.append("line %s" % i)
+    text = logs.getvalue()
+    assert len(text) <= 100
+    assert text.endswith("line 99\n")
+    assert text.startswith("[...] ")
+
+
+def test_log_capture_after_worker_logging_setup(caplog):
+    from hub2labhook.jobs.runner import app
+
+    app.log.setup()
+    caplog.set_level(logging.INFO)
+    with LogCapture() as logs:
+        logging.getLogger("hub2labhook.test").info("this build")
+    assert logs.getvalue() == "[INFO]  this build\n"
@@ -0,0 +1,35 @@
+import threading
+from hub2labhook.progress import ProgressReporter
+
+
+def test_updates_throttled():
+    flushed = threading.Event()
+    calls = []
+
+    def flush():
+        calls.append(1)
+        flushed.set()
+
+    with ProgressReporter(flush, interval=60) as reporter:
+        reporter.update()
+        assert flushed.wait(5)
+        for _ in range(10):
+            reporter.update()
+    # the first update is flushed right away, the next ones wait for the
+    # interval and are dropped on stop
+    assert calls == [1]
+
+
+def test_flush_errors_ignored():
+    flushed = threading.Event()
+
+    def flush():
+        flushed.set()
+        raise IOError("github down")
+
+    with ProgressReporter(flush, interval=0) as reporter:
+        reporter.update()
+        assert flushed.wait(5)
+        flushed.clear()
+        reporter.update()
+        assert flushed.wait(5)
@@ -0,0 +1,32 @@
+import json
+import hub2labhook.jobs.tasks as tasks
+
+
+def comment_event(body):
+    return {
+        "action": "created",
+        "issue": {"pull_request": {"url": "https://api.github.com/repos/a/b/pulls/1"}},
+        "comment": {"body": body},
+        "installation": {"id": 1},
+        "repository": {"full_name": "a/b"},
+    }
+
+
+def test_retest_comment_routed_to_pipeline():
+    job = tasks.github_event_job(
+        comment_event("/retest --force"), {"X-GitHub-Event": "issue_comment"}
+    )
+    prep, pipeline = job.tasks
+    assert prep.task == tasks.prep_retry_comment.name
+    assert pipeline.task == tasks.pipeline.name
+    assert pipeline.kwargs == {"force": True}
+    # the event is the envelope returned by prep_retry_comment
+    assert pipeline.args == ()
+
+
+def test_route_event_ignores_other_events(monkeypatch):
+    body = json.dumps(comment_event("looks good"))
+    assert tasks.route_event(body, {"X-GitHub-Event": "issue_comment"}) == {
+        "ignored": True,
+        "event": "issue_comment",
+    }
@@ -0,0 +1,21 @@
+from celery import Task
+
+from hub2labhook.jobs import celeryconfig, tasks
+
+
+def test_every_task_routed():
+    names = [
+        obj.name
+        for obj in vars(tasks).values()
+        if isinstance(obj, Task) and obj.name.startswith(celeryconfig.TASKS)
+    ]
+    assert names
+    assert sorted(names) == sorted(celeryconfig.task_routes)
+
+
+def test_task_queues():
+    assert tasks.pipeline.task_queue() == "sync"
+    assert tasks.pipeline.task_routing_key() == "sync"
+    assert tasks.update_github_check.task_queue() == "status"
+    assert tasks.skip_check.task_queue() == "admin"
+    assert tasks.route_event.task_priority() == 0
@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+from kombu.serialization import dumps, loads
+
+pytest.importorskip("msgpack")
+
+from hub2labhook.jobs import serializers  # noqa: E402
+
+
+@pytest.mark.parametrize("compression,header", [("zlib", serializers.ZLIB), ("none", serializers.RAW)])
+def test_roundtrip_compressed(pipeline_hook_data, compression, header):
+    body = [[pipeline_hook_data], {}, {"callbacks": None}]
+    data = serializers.dumps(body, threshold=1024, compression=compression)
+    assert data[:1] == header
+    assert serializers.loads(data) == body
+
+
+def test_zstd_roundtrip(pipeline_hook_data):
+    pytest.importorskip("zstandard")
+    data = serializers.dumps(pipeline_hook_data, threshold=1024, compression="zstd")
+    assert data[:1] == serializers.ZSTD
+    assert serializers.loads(data) == pipeline_hook_data
+
+
+def test_small_bodies_not_compressed():
+    data = serializers.dumps({"id": 1}, threshold=1024, compression="zlib")
+    assert data[:1] == serializers.RAW
+    assert serializers.loads(data) == {"id": 1}
+
+
+def test_dates_as_strings():
+    data = serializers.dumps({"at": datetime.datetime(2020, 1, 2, 3, 4, 5)})
+    assert serializers.loads(data) == {"at": "2020-01-02T03:04:05"}
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        serializers.dumps({"id": 1}, compression="lz4")
+
+
+def test_registered_with_kombu(build_hook_data):
+    assert serializers.register()
+    content_type, encoding, data = dumps(build_hook_data, serializer=serializers.NAME)
+    assert content_type == serializers.CONTENT_TYPE
+    assert loads(data, content_type, encoding, accept=[content_type]) == build_hook_data
@@ -0,0 +1,32 @@
+import threading
+import pytest
+from hub2labhook.steps import StepGraph
+
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    done = []
+    graph = StepGraph(max_workers=2, on_step_done=done.append)
+    graph.add("a", lambda: (barrier.wait(), "a")[1])
+    graph.add("b", lambda: (barrier.wait(), "b")[1])
+    graph.add("c", lambda: graph.results["a"] + graph.results["b"], after=["a", "b"])
+    assert graph.run()["c"] == "ab"
+    assert done[-1] == "c"
+    assert list(graph.timings)[-1] == "c"
+
+
+def test_failure_stops_scheduling():
+    ran = []
+    graph = StepGraph()
+
+    def fail():
+        raise KeyError("boom")
+
+    graph.add("slow", lambda: ran.append("slow"))
+    graph.add("fail", fail)
+    graph.add("after", lambda: ran.append("after"), after=["fail"])
+    with pytest.raises(KeyError):
+        graph.run()
+    assert ran == ["slow"]
+    with pytest.raises(ValueError):
+        graph.add("x", fail, after=["unknown"])
@@ -0,0 +1,16 @@
+from hub2labhook import transport
+
+
+def test_session_per_host():
+    transport.reset_sessions()
+    gh = transport.session("https://api.github.com/repos/a/b", timeout=5)
+    assert transport.session("https://api.github.com/app") is gh
+    assert transport.session("https://gitlab.com/api/v4") is not gh
+    assert gh.timeout == 5
+
+
+def test_session_reset_after_fork(monkeypatch):
+    transport.reset_sessions()
+    sess = transport.session("https://api.github.com")
+    monkeypatch.setattr(transport.os, "getpid", lambda: -1)
+    assert transport.session("https://api.github.com") is not sess
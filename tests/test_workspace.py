@@ -0,0 +1,67 @@
+import os
+import pytest
+from hub2labhook.workspace import WorkspaceManager
+
+
+@pytest.fixture()
+def manager(tmp_path):
+    return WorkspaceManager(str(tmp_path / "ws"), quota=1024)
+
+
+def test_workspace_removed_after_build(manager):
+    with pytest.raises(ValueError):
+        with manager.workspace("org/repo-abc") as path:
+            assert os.path.isdir(path)
+            raise ValueError("build failed")
+    manager.executor.shutdown(wait=True)
+    assert not os.path.exists(path)
+
+
+def test_workspace_concurrent_same_key(manager):
+    with manager.workspace("org/repo-abc") as path1:
+        with manager.workspace("org/repo-abc") as path2:
+            assert path1 != path2
+
+
+def test_workspace_quota_evicts_idle_dirs(manager):
+    idle = os.path.join(manager.root, "idle")
+    os.makedirs(idle)
+    with open(os.path.join(idle, "big"), "wb") as f:
+        f.write(b"0" * 2048)
+    with manager.workspace("live") as path:
+        with open(os.path.join(path, "big"), "wb") as f:
+            f.write(b"0" * 2048)
+        # the live checkout isn't counted
+        assert manager.enforce_quota() == 0
+        assert not os.path.exists(idle)
+        assert os.path.exists(path)
+
+
+def test_workspace_quota_enforced_on_allocate(manager, monkeypatch):
+    from hub2labhook import workspace
+
+    for i, name in enumerate(("idle1", "idle2")):
+        os.makedirs(os.path.join(manager.root, name))
+        with open(os.path.join(manager.root, name, "big"), "wb") as f:
+            f.write(b"0" * 800)
+        os.utime(os.path.join(manager.root, name), (i, i))
+    measured = []
+    monkeypatch.setattr(
+        workspace, "disk_usage", lambda path: measured.append(path) or 800
+    )
+    with manager.workspace("live") as path:
+        # the oldest idle directory was evicted before the build started
+        assert sorted(os.listdir(manager.root)) == [
+            "idle2",
+            "idle2.lock",
+            "idle2.size",
+            "live",
+            "live.lock",
+        ]
+        manager.enforce_quota()
+        assert path not in measured
+    manager.executor.shutdown(wait=True)
+    # idle2 isn't walked again, live once released
+    assert sorted(measured) == [
+        os.path.join(manager.root, n) for n in ("idle1", "idle2", "live")
+    ]